@@ -0,0 +1,272 @@
+import os
+from array import array
+from itertools import product
+
+type Bitboard = int
+
+EMPTY_BITBOARD = 0
+FULL_BITBOARD = (1 << 64) - 1
+
+BISHOP_DELTAS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+ROOK_DELTAS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+
+# Sliding attacks are found with a single table lookup. For every square we
+# keep a mask of the squares that can block the slider (the edge squares
+# never block, since there is nothing behind them). Masking the board
+# occupancy with it gives a key into that square's attack table. This is
+# the same scheme as magic bitboards, except that python's dict does the
+# hashing for us, which is faster than doing the magic multiply by hand.
+
+
+def get_ray(square: int, delta: tuple[int, int]) -> list[int]:
+    """Return the squares from square (exclusive) to the edge of the board
+    in the direction of delta"""
+    ray = []
+    row, col = divmod(square, 8)
+    dr, dc = delta
+    r, c = row + dr, col + dc
+    while 0 <= r < 8 and 0 <= c < 8:
+        ray.append(r*8 + c)
+        r += dr
+        c += dc
+    return ray
+
+
+def get_ray_variations(ray: list[int]) -> list[tuple[Bitboard, Bitboard]]:
+    """Return a (blockers, attacks) pair for every way the ray can be blocked"""
+    relevant = ray[:-1]
+    variations = []
+    for subset in range(1 << len(relevant)):
+        blockers = EMPTY_BITBOARD
+        for i, square in enumerate(relevant):
+            if subset & (1 << i):
+                blockers |= 1 << square
+        attacks = EMPTY_BITBOARD
+        for square in ray:
+            attacks |= 1 << square
+            if blockers & (1 << square):
+                break
+        variations.append((blockers, attacks))
+    return variations
+
+
+def build_slider_tables(deltas) -> tuple[list[Bitboard], list[dict[Bitboard, Bitboard]]]:
+    masks = [EMPTY_BITBOARD] * 64
+    tables = [{} for _ in range(64)]
+    for square in range(64):
+        rays = [get_ray_variations(get_ray(square, delta)) for delta in deltas]
+        table = tables[square]
+        for combo in product(*rays):
+            blockers = EMPTY_BITBOARD
+            attacks = EMPTY_BITBOARD
+            for ray_blockers, ray_attacks in combo:
+                blockers |= ray_blockers
+                attacks |= ray_attacks
+            table[blockers] = attacks
+            masks[square] |= blockers
+    return masks, tables
+
+
+
+
+def bishop_attacks(square: int, occupied: Bitboard) -> Bitboard:
+    """Squares attacked by a bishop on square, up to and including the first
+    piece in each direction"""
+    return BISHOP_ATTACKS[square][occupied & BISHOP_MASKS[square]]
+
+
+def rook_attacks(square: int, occupied: Bitboard) -> Bitboard:
+    """Squares attacked by a rook on square, up to and including the first
+    piece in each direction"""
+    return ROOK_ATTACKS[square][occupied & ROOK_MASKS[square]]
+
+
+def queen_attacks(square: int, occupied: Bitboard) -> Bitboard:
+    return (BISHOP_ATTACKS[square][occupied & BISHOP_MASKS[square]]
+            | ROOK_ATTACKS[square][occupied & ROOK_MASKS[square]])
+
+
+def build_line_tables() -> tuple[list[list[Bitboard]], list[list[Bitboard]]]:
+    """
+    BETWEEN[a][b] is the squares strictly between a and b, and LINE[a][b] the
+    whole line across the board through both of them (a and b included), if
+    they share a rank, file or diagonal. Both are empty otherwise.
+    """
+    between = [[EMPTY_BITBOARD] * 64 for _ in range(64)]
+    line = [[EMPTY_BITBOARD] * 64 for _ in range(64)]
+    for square in range(64):
+        for dr, dc in BISHOP_DELTAS + ROOK_DELTAS:
+            ray = get_ray(square, (dr, dc))
+            full = 1 << square
+            for target in ray + get_ray(square, (-dr, -dc)):
+                full |= 1 << target
+            passed = EMPTY_BITBOARD
+            for target in ray:
+                between[square][target] = passed
+                line[square][target] = full
+                passed |= 1 << target
+    return between, line
+
+
+def build_step_table(deltas) -> tuple[Bitboard, ...]:
+    """The squares a piece reaches from each square in one step of any of
+    the deltas (knights, kings and pawn captures)"""
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        attacks = EMPTY_BITBOARD
+        for dr, dc in deltas:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                attacks |= 1 << (r*8 + c)
+        table.append(attacks)
+    return tuple(table)
+
+
+def build_push_table(step: int, start_row: int | None=None) -> tuple[int, ...]:
+    """The square a pawn pushes to from each square, or -1. A double push
+    (start_row set) is only possible from the pawn's starting row"""
+    table = []
+    for square in range(64):
+        row = square // 8
+        target = square + step
+        if start_row is not None and row != start_row or not 0 <= target < 64:
+            target = -1
+        table.append(target)
+    return tuple(table)
+
+
+def build_slider_masks(deltas) -> tuple[Bitboard, ...]:
+    """For every square, the squares that can block a slider on it"""
+    masks = []
+    for square in range(64):
+        mask = EMPTY_BITBOARD
+        for delta in deltas:
+            for target in get_ray(square, delta)[:-1]:
+                mask |= 1 << target
+        masks.append(mask)
+    return tuple(masks)
+
+
+def build_tables(slider_attacks=None) -> dict:
+    """Every precomputed table, by name. The bishop and rook attack tables
+    take nearly all of the time, so they can be passed in, e.g. from the
+    disk cache"""
+    if slider_attacks is None:
+        slider_attacks = (build_slider_tables(BISHOP_DELTAS)[1], build_slider_tables(ROOK_DELTAS)[1])
+    bishop_tables, rook_tables = slider_attacks
+    between, line = build_line_tables()
+    return {
+        "BISHOP_MASKS": build_slider_masks(BISHOP_DELTAS),
+        "BISHOP_ATTACKS": tuple(bishop_tables),
+        "ROOK_MASKS": build_slider_masks(ROOK_DELTAS),
+        "ROOK_ATTACKS": tuple(rook_tables),
+        "BETWEEN": tuple(map(tuple, between)),
+        "LINE": tuple(map(tuple, line)),
+        "KNIGHT_MOVES": build_step_table([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (2, -1), (2, 1), (1, -2), (1, 2)]),
+        "KING_MOVES": build_step_table(BISHOP_DELTAS + ROOK_DELTAS),
+        # white pawns move up the board, towards row 0
+        "PAWN_ATTACKS_WHITE": build_step_table([(-1, 1), (-1, -1)]),
+        "PAWN_ATTACKS_BLACK": build_step_table([(1, 1), (1, -1)]),
+        "PAWN_PUSHES_WHITE": build_push_table(-8),
+        "PAWN_PUSHES_BLACK": build_push_table(8),
+        "PAWN_DOUBLE_PUSHES_WHITE": build_push_table(-16, 6),
+        "PAWN_DOUBLE_PUSHES_BLACK": build_push_table(16, 1),
+        # rays in the order N, S, W, E and NE, SE, SW, NW
+        "ROOK_RAYS": tuple(tuple(tuple(get_ray(square, delta)) for delta in [(-1, 0), (1, 0), (0, -1), (0, 1)])
+                           for square in range(64)),
+        "BISHOP_RAYS": tuple(tuple(tuple(get_ray(square, delta)) for delta in [(1, 1), (-1, 1), (-1, -1), (1, -1)])
+                             for square in range(64)),
+    }
+
+
+# Building the slider attack tables takes a noticeable fraction of a second,
+# which every process pays on import (including each perft or search
+# worker). Setting CHESS_TABLE_CACHE to a file name saves them there the
+# first time and loads them from it afterwards; the other tables are quick
+# to build. The file is a header followed by each square's keys and then
+# its attacks, all as raw 64 bit words. How many a square has follows from
+# its mask, so nothing in the file decides how much is read. In memory
+# the tables are tuples and dicts, since indexing an array makes a new int
+# every time.
+
+TABLE_CACHE_MAGIC = 0x7365_6c62_6174_6863
+TABLE_CACHE_VERSION = 2
+
+
+def slider_table_sizes() -> list[int]:
+    """The number of entries in each bishop then rook attack table"""
+    return [1 << mask.bit_count()
+            for mask in build_slider_masks(BISHOP_DELTAS) + build_slider_masks(ROOK_DELTAS)]
+
+
+def save_tables(path: str, tables: dict):
+    header = array('Q', [TABLE_CACHE_MAGIC, TABLE_CACHE_VERSION])
+    words = array('Q')
+    for attacks in tables["BISHOP_ATTACKS"] + tables["ROOK_ATTACKS"]:
+        words.extend(attacks.keys())
+        words.extend(attacks.values())
+    # write then rename, so a reader never sees half a file
+    temp = f"{path}.{os.getpid()}"
+    with open(temp, "wb") as f:
+        header.tofile(f)
+        words.tofile(f)
+    os.replace(temp, path)
+
+
+def load_tables(path: str) -> dict | None:
+    """The tables, with the slider attacks read from path, or None if there
+    isn't a usable cache there"""
+    sizes = slider_table_sizes()
+    header = array('Q')
+    words = array('Q')
+    try:
+        with open(path, "rb") as f:
+            header.fromfile(f, 2)
+            if header.tolist() != [TABLE_CACHE_MAGIC, TABLE_CACHE_VERSION]:
+                return None # another version, or not a table cache at all
+            words.fromfile(f, 2 * sum(sizes))
+            if f.read(1):
+                return None
+    except (OSError, EOFError): # missing, unreadable or cut short
+        return None
+    tables = []
+    start = 0
+    for size in sizes:
+        tables.append(dict(zip(words[start:start + size], words[start + size:start + 2*size])))
+        start += 2*size
+    return build_tables((tables[:64], tables[64:]))
+
+
+def get_tables() -> dict:
+    path = os.environ.get("CHESS_TABLE_CACHE")
+    tables = load_tables(path) if path else None
+    if tables is None:
+        tables = build_tables()
+        if path:
+            try:
+                save_tables(path, tables)
+            except OSError:
+                pass # the cache is only an optimisation
+    return tables
+
+
+_TABLES = get_tables()
+BISHOP_MASKS = _TABLES["BISHOP_MASKS"]
+BISHOP_ATTACKS = _TABLES["BISHOP_ATTACKS"]
+ROOK_MASKS = _TABLES["ROOK_MASKS"]
+ROOK_ATTACKS = _TABLES["ROOK_ATTACKS"]
+BETWEEN = _TABLES["BETWEEN"]
+LINE = _TABLES["LINE"]
+KNIGHT_MOVES = _TABLES["KNIGHT_MOVES"]
+KING_MOVES = _TABLES["KING_MOVES"]
+PAWN_ATTACKS_WHITE = _TABLES["PAWN_ATTACKS_WHITE"]
+PAWN_ATTACKS_BLACK = _TABLES["PAWN_ATTACKS_BLACK"]
+PAWN_PUSHES_WHITE = _TABLES["PAWN_PUSHES_WHITE"]
+PAWN_PUSHES_BLACK = _TABLES["PAWN_PUSHES_BLACK"]
+PAWN_DOUBLE_PUSHES_WHITE = _TABLES["PAWN_DOUBLE_PUSHES_WHITE"]
+PAWN_DOUBLE_PUSHES_BLACK = _TABLES["PAWN_DOUBLE_PUSHES_BLACK"]
+ROOK_RAYS = _TABLES["ROOK_RAYS"]
+BISHOP_RAYS = _TABLES["BISHOP_RAYS"]
+QUEEN_RAYS = tuple(ROOK_RAYS[square] + BISHOP_RAYS[square] for square in range(64))
+del _TABLES
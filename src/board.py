@@ -3,7 +3,7 @@ from typing import List, Tuple
 import copy
 import time
 import random
-from eval import evaluate_board
+from concurrent.futures import as_completed
 
 from pygame.event import get
 from util import (BLACK_BISHOP, START_BOARD, WHITE, BLACK, PAWN, BISHOP, KNIGHT, ROOK, QUEEN, KING,
@@ -12,57 +12,116 @@ from util import (BLACK_BISHOP, START_BOARD, WHITE, BLACK, PAWN, BISHOP, KNIGHT,
                   EMPTY, get_colour, get_piece_name, strip_piece, tuple_add, tuple_diff, out_of_bounds,
                   WHITE_PAWN, BLACK_PAWN, WHITE_KING, BLACK_KING, WHITE_KING_START, BLACK_KING_START,
                   make_bit_board, print_bit_board,  check_bit_board, set_bit_board, PIECES, SLIDING_PIECES,
-                  WHITE_PIECES, BLACK_PIECES, ALL, assemble_start_board, ZOBRIST_CASTLE, ZOBRIST_EP, ZOBRIST_PIECE, ZOBRIST_SIDE, PIECE_INDEX)
+                  WHITE_PIECES, BLACK_PIECES, ALL, assemble_start_board, ZOBRIST_CASTLE, ZOBRIST_EP, ZOBRIST_PIECE, ZOBRIST_SIDE, PIECE_INDEX,
+                  MOVE_SQUARE, MOVE_PROMOTION, END_SHIFT, PROMOTION_SHIFT, CAPTURE_FLAG, EP_FLAG, CASTLE_FLAG, DOUBLE_PUSH_FLAG,
+                  WHITE_KNIGHT, BLACK_KNIGHT, WHITE_BISHOP, WHITE_ROOK, BLACK_ROOK, WHITE_QUEEN, BLACK_QUEEN,
+                  move_promotion, move_to_uci, KeyedCache, process_pool,
+                  WHITE_PAWNS, BLACK_PAWNS, WHITE_KNIGHTS, BLACK_KNIGHTS, WHITE_BISHOPS, BLACK_BISHOPS,
+                  WHITE_ROOKS, BLACK_ROOKS, WHITE_QUEENS, BLACK_QUEENS, WHITE_KINGS, BLACK_KINGS)
+from eval import PIECE_MATERIAL, PIECE_PHASES, PST_MIDGAME, PST_ENDGAME, PIECE_VALS
+from attacks import (Bitboard, EMPTY_BITBOARD, FULL_BITBOARD, bishop_attacks, rook_attacks, queen_attacks, BETWEEN, LINE, KNIGHT_MOVES, KING_MOVES,
+                     PAWN_PUSHES_WHITE, PAWN_PUSHES_BLACK, PAWN_DOUBLE_PUSHES_WHITE, PAWN_DOUBLE_PUSHES_BLACK,
+                     PAWN_ATTACKS_WHITE, PAWN_ATTACKS_BLACK, BISHOP_RAYS, ROOK_RAYS, QUEEN_RAYS)
 
-type Bitboard = int
 type Ray = list[int]
-EMPTY_BITBOARD = 0
 
 ROOK_DIRS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
 BISHOP_DIRS = [(1,1), (1,-1), (-1, 1), (-1,-1)]
 
-START = 0
-END = 1 
-PIECE = 2 
-CAPTURED_PIECE = 3 
-CAPTURED_SQUARE = 4 
-CASTLING = 5
-EP_TARGET = 6
-HALFS = 7
-FULLS = 8
-TURN = 9
-PROMOTION = 10
-CASTLE = 11
-
-DEPTH = 0
-SCORE = 1
-FLAG = 2
-MOVE = 3
-
-EXACT = 0
-UPPERBOUND = 1 
-LOWERBOUND = 2
-
-class TranspositionTable():
-    def __init__(self):
-        self.table = {}
-
-    def lookup(self, key, depth):
-        entry = self.table.get(key)
-        if entry and entry[0] >= depth:
-            return entry
-        return
-
-    def store(self, key, depth, score, flag, move):
-        entry = self.table.get(key)
-        if entry is None or depth >= entry[0]:
-            self.table[key] = (depth, score, flag, move)
+# The state move_piece hands back to unmake_move is packed into a single int:
+#   bits 0-3:   captured piece (EMPTY if nothing was captured)
+#   bits 4-7:   castling rights
+#   bits 8-14:  ep target square (NO_EP if there was none)
+#   bits 15-31: half move clock
+#   bits 32-95: zobrist hash
+UNDO_PIECE = 15
+UNDO_CASTLING_SHIFT = 4
+UNDO_EP_SHIFT = 8
+UNDO_EP = 127
+UNDO_HALFS_SHIFT = 15
+UNDO_HALFS = (1 << 17) - 1
+UNDO_ZOBRIST_SHIFT = 32
+NO_EP = 64
+
+PROMOTIONS = [BISHOP, KNIGHT, ROOK, QUEEN]
+
+# which moves the generators should produce
+GEN_ALL = 0
+GEN_NOISY = 1 # captures and promotions
+GEN_QUIET = 2 # everything else
+
+class PositionStatus():
+    """The legal moves of the side to move and whether it is in check,
+    which is everything needed to tell if the game is over"""
+
+    def __init__(self, legal_moves, in_check):
+        self.legal_moves = legal_moves
+        self.in_check = in_check
+        self.is_checkmate = in_check and not legal_moves
+        self.is_stalemate = not in_check and not legal_moves
+        self.is_game_over = not legal_moves
+
+
+class CheckInfo():
+    """
+    What the legality and check tests need to know about a position, worked
+    out once per position for the side to move:
+      checkers:      bitboard of the enemy pieces giving check
+      block_mask:    squares a move other than a king move has to end on:
+                     every square when not in check, the checker and the
+                     squares in between for a single check, none in double check
+      pinned:        bitboard of our pieces pinned to the king. A pinned
+                     piece can only move along LINE[king][its square]
+      check_squares: per piece type, the squares from which one of our pieces
+                     of that type would give check (see Game.get_check_squares)
+      discoverers:   bitboard of our pieces that would give a discovered check
+                     by moving off their line (see Game.get_discoverers)
+      attacks:       the enemy attack map (see Game.get_enemy_attacks)
+    The last three are only worked out when something asks for them.
+    """
+
+    def __init__(self, checkers, block_mask, pinned):
+        self.checkers = checkers
+        self.block_mask = block_mask
+        self.pinned = pinned
+        self.check_squares = None
+        self.discoverers = None
+        self.attacks = None
+
+
+# least valuable first, the order pieces join an exchange in
+SEE_ORDER = [PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING]
+
+
+# the zobrist keys of the pawns, and 0 for every other piece, indexed by the
+# piece itself
+PAWN_KEYS = [[0] * 64 for _ in range(16)]
+PAWN_KEYS[WHITE_PAWN] = ZOBRIST_PIECE[WHITE_PAWNS]
+PAWN_KEYS[BLACK_PAWN] = ZOBRIST_PIECE[BLACK_PAWNS]
+
+
+def piece_bitboard(index):
+    """A read-only attribute for one of the bitboards in Game.bitboards"""
+    return property(lambda self: self.bitboards[index])
 
 
 class Game():
     """Simulates a chess game. Keeps track of the game state and calculates
     legal moves. Also handles move generation and lookahead"""
 
+    # the precomputed tables are shared by every game
+    knight_moves = KNIGHT_MOVES
+    king_moves = KING_MOVES
+    pawn_pushes_white = PAWN_PUSHES_WHITE
+    pawn_pushes_black = PAWN_PUSHES_BLACK
+    pawn_double_pushes_white = PAWN_DOUBLE_PUSHES_WHITE
+    pawn_double_pushes_black = PAWN_DOUBLE_PUSHES_BLACK
+    pawn_attacks_white = PAWN_ATTACKS_WHITE
+    pawn_attacks_black = PAWN_ATTACKS_BLACK
+    bishop_rays = BISHOP_RAYS
+    rook_rays = ROOK_RAYS
+    queen_rays = QUEEN_RAYS
+
     def __init__(self, board=None, turn: int=WHITE,
                  castling: int=ALL, ep_target: Tuple[int, int] | None=None,
                  halfs: int=0, fulls: int=0):
@@ -85,58 +144,51 @@ class Game():
 
         self.white_pieces: Bitboard = EMPTY_BITBOARD
         self.black_pieces: Bitboard = EMPTY_BITBOARD
-        self.white_pawns: Bitboard = EMPTY_BITBOARD
-        self.white_knights: Bitboard = EMPTY_BITBOARD
-        self.white_bishops: Bitboard = EMPTY_BITBOARD
-        self.white_rooks: Bitboard = EMPTY_BITBOARD
-        self.white_queens: Bitboard = EMPTY_BITBOARD
+        # one bitboard per piece, indexed by PIECE_INDEX
+        self.bitboards: list[Bitboard] = [EMPTY_BITBOARD] * 12
         self.white_king: int = -1
-        self.black_pawns: Bitboard = EMPTY_BITBOARD
-        self.black_knights: Bitboard = EMPTY_BITBOARD
-        self.black_bishops: Bitboard = EMPTY_BITBOARD
-        self.black_rooks: Bitboard = EMPTY_BITBOARD
-        self.black_queens: Bitboard = EMPTY_BITBOARD
         self.black_king: int = -1
+        # the evaluation, kept up to date by set_piece and remove_piece (see
+        # eval.build_piece_square_tables)
+        self.material: int = 0
+        self.phase: int = 0
+        # zobrist key of the pawns alone, for the pawn structure cache
+        self.pawn_key: int = 0
+        self.pst_midgame: int = 0
+        self.pst_endgame: int = 0
 
         for square in range(64):
                 piece = self.board[square]
                 if piece != EMPTY:
                     self.set_piece(square, piece)
 
-        self.knight_moves: list[Bitboard] = self.get_knight_moves()
-        self.king_moves: list[Bitboard] = self.get_king_moves()
-        self.pawn_pushes_white: list[int] = self.get_white_pawn_pushes() #list of squares
-        self.pawn_pushes_black: list[int] = self.get_black_pawn_pushes() #list of squares
-        self.pawn_double_pushes_white: list[int] = self.get_white_double_pawn_pushes()
-        self.pawn_double_pushes_black: list[int] = self.get_black_double_pawn_pushes()
-        self.pawn_attacks_white: list[Bitboard] = self.get_white_pawn_attacks()
-        self.pawn_attacks_black: list[Bitboard] = self.get_black_pawn_attacks()
-        self.bishop_rays: list[list[Ray]] = self.get_bishop_rays()
-        self.rook_rays: list[list[Ray]] = self.get_rook_rays()
-        self.queen_rays: list[list[Ray]] = [self.rook_rays[square] + self.bishop_rays[square] for square in range(64)]
-
         self.white_captured_list = []
         self.black_captured_list = []
 
         self.zobrist = self.compute_hash()
 
+        # the CheckInfo of the current position, if it has been needed yet.
+        # move_piece saves it on the stack and unmake_move puts it back
+        self.check_info = None
+        self.check_info_stack = []
+
+        # the engine's search state (e.g. its transposition table), kept
+        # between moves. Created on the first computer move
+        self.searcher = None
+
     def reset_board(self):
         self.board = assemble_start_board()
 
         self.white_pieces: Bitboard = EMPTY_BITBOARD
         self.black_pieces: Bitboard = EMPTY_BITBOARD
-        self.white_pawns: Bitboard = EMPTY_BITBOARD
-        self.white_knights: Bitboard = EMPTY_BITBOARD
-        self.white_bishops: Bitboard = EMPTY_BITBOARD
-        self.white_rooks: Bitboard = EMPTY_BITBOARD
-        self.white_queens: Bitboard = EMPTY_BITBOARD
+        self.bitboards: list[Bitboard] = [EMPTY_BITBOARD] * 12
         self.white_king: int = -1
-        self.black_pawns: Bitboard = EMPTY_BITBOARD
-        self.black_knights: Bitboard = EMPTY_BITBOARD
-        self.black_bishops: Bitboard = EMPTY_BITBOARD
-        self.black_rooks: Bitboard = EMPTY_BITBOARD
-        self.black_queens: Bitboard = EMPTY_BITBOARD
         self.black_king: int = -1
+        self.material = 0
+        self.phase = 0
+        self.pawn_key = 0
+        self.pst_midgame = 0
+        self.pst_endgame = 0
 
         for square in range(64):
                 piece = self.board[square]
@@ -148,6 +200,13 @@ class Game():
         self.ep_target = None
         self.turn = WHITE
         self.castling = ALL
+        self.halfs = 0
+        self.fulls = 0
+        self.zobrist = self.compute_hash()
+        self.check_info = None
+        self.check_info_stack = []
+        if self.searcher is not None:
+            self.searcher.tt.clear()
 
 
 
@@ -171,134 +230,35 @@ class Game():
 
 
 
-    def set_bitboards(self):
-        self.white_pieces = (self.white_pawns | self.white_bishops
-        | self.white_knights | self.white_rooks | self.white_king)
-        self.black_pieces = (self.black_pawns | self.black_bishops
-        | self.black_knights | self.black_rooks | self.black_king)
-        self.pieces = self.white_pieces | self.black_pieces
-
-    def get_knight_moves(self):
-        knight_moves = [EMPTY_BITBOARD] * 64
-        for square in range(64):
-            attacks = EMPTY_BITBOARD
-            row, col = divmod(square, 8)
-            for drow, drcol in [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (2, -1), (2, 1), (1, -2), (1, 2)]:
-                r, c = row + drow, col + drcol
-                if 0 <= r < 8 and 0 <= c < 8:
-                    attacks |= 1 << (r*8 + c)
-            knight_moves[square] = attacks
-        return knight_moves
-
-    def get_king_moves(self):
-        king_moves = [EMPTY_BITBOARD] * 64
-        for square in range(64):
-            attacks = EMPTY_BITBOARD
-            row, col = divmod(square, 8)
-            for drow, drcol in [(-1, 1), (0, 1), (1, 1), (-1, 0), (1, 0), (-1, -1), (0, -1), (1, -1)]:
-                r, c = row + drow, col + drcol 
-                if 0 <= r < 8 and 0 <= c < 8:
-                    attacks |= 1 << (r*8 + c)
-            king_moves[square] = attacks
-        return king_moves
-
-    def get_white_pawn_attacks(self):
-        pawn_moves = [EMPTY_BITBOARD] * 64
-        for square in range(64):
-            attacks = EMPTY_BITBOARD
-            row, col = divmod(square, 8)
-
-            if row > 0 and col < 7:
-                attacks |= 1 << ((row-1)*8 + (col+1))
-            if row > 0 and col > 0:
-                attacks |= 1 << ((row-1)*8 + (col-1))
-
-            pawn_moves[square] = attacks
-        return pawn_moves
-    
-    def get_black_pawn_attacks(self):
-        pawn_moves = [EMPTY_BITBOARD] * 64
-        for square in range(64):
-            attacks = EMPTY_BITBOARD
-            row, col = divmod(square, 8)
-
-            if row < 7 and col < 7:
-                attacks |= 1 << ((row+1)*8 + (col+1))
-            if row < 7 and col > 0:
-                attacks |= 1 << ((row+1)*8 + (col-1))
-
-            pawn_moves[square] = attacks
-        return pawn_moves
-
-    def get_white_pawn_pushes(self):
-        moves = [-1] * 64
-        for square in range(64):
-            row, col = divmod(square, 8)
-            if row > 0:
-                moves[square] = (row-1)*8 + col
-        return moves
-
-    def get_black_pawn_pushes(self):
-        moves = [-1] * 64
-        for square in range(64):
-            row, col = divmod(square, 8)
-            if row < 7:
-                moves[square] = (row+1)*8 + col
-        return moves
-
-    def get_white_double_pawn_pushes(self):
-        moves = [-1] * 64
-        for square in range(64):
-            row, col = divmod(square, 8)
-            if row == 6:
-                moves[square] = (row-2)*8 + col
-        return moves
-
-    def get_black_double_pawn_pushes(self):
-        moves = [-1] * 64
-        for square in range(64):
-            row, col = divmod(square, 8)
-            if row == 1:
-                moves[square] = (row+2)*8 + col
-        return moves
-
+    white_pawns = piece_bitboard(WHITE_PAWNS)
+    white_knights = piece_bitboard(WHITE_KNIGHTS)
+    white_bishops = piece_bitboard(WHITE_BISHOPS)
+    white_rooks = piece_bitboard(WHITE_ROOKS)
+    white_queens = piece_bitboard(WHITE_QUEENS)
+    black_pawns = piece_bitboard(BLACK_PAWNS)
+    black_knights = piece_bitboard(BLACK_KNIGHTS)
+    black_bishops = piece_bitboard(BLACK_BISHOPS)
+    black_rooks = piece_bitboard(BLACK_ROOKS)
+    black_queens = piece_bitboard(BLACK_QUEENS)
 
     def set_piece(self, square: int, piece: int):
         if piece == EMPTY:
             return
-        colour = get_colour(piece)
-        piece_type = strip_piece(piece)
         place = 1 << square
-        if colour == WHITE:
+        self.bitboards[PIECE_INDEX[piece]] |= place
+        self.material += PIECE_MATERIAL[piece]
+        self.phase += PIECE_PHASES[piece]
+        self.pawn_key ^= PAWN_KEYS[piece][square]
+        self.pst_midgame += PST_MIDGAME[piece][square]
+        self.pst_endgame += PST_ENDGAME[piece][square]
+        if piece & WHITE:
             self.white_pieces |= place
-
-            if piece_type == PAWN:
-                self.white_pawns |= place 
-            elif piece_type == BISHOP:
-                self.white_bishops |= place 
-            elif piece_type == KNIGHT:
-                self.white_knights |= place
-            elif piece_type == ROOK:
-                self.white_rooks |= place 
-            elif piece_type == QUEEN:
-                self.white_queens |= place
-            else:
+            if piece == WHITE_KING:
                 self.white_king = square
         else:
             self.black_pieces |= place
-            if piece_type == PAWN:
-                self.black_pawns |= place 
-            elif piece_type == BISHOP:
-                self.black_bishops |= place 
-            elif piece_type == KNIGHT:
-                self.black_knights |= place
-            elif piece_type == ROOK:
-                self.black_rooks |= place 
-            elif piece_type == QUEEN:
-                self.black_queens |= place
-            else:
+            if piece == BLACK_KING:
                 self.black_king = square
-
         self.board[square] = piece
 
 
@@ -371,77 +331,6 @@ class Game():
                 mask |= 1 << (r*8 + c)
         return mask
 
-    def get_rook_rays(self) -> List[List[List[int]]]:
-        rook_rays = [[] for _ in range(64)]
-        for square in range(64):
-            row, col = divmod(square, 8)
-
-            ray = []
-            for r in range(row-1, -1, -1):
-                ray.append(r*8 + col)
-            rook_rays[square].append(ray)
-
-            ray = []
-            for r in range(row+1, 8):
-                ray.append(r*8 + col)
-            rook_rays[square].append(ray)
-
-            ray = []
-            for c in range(col-1, -1, -1):
-                ray.append(row*8 + c)
-            rook_rays[square].append(ray)
-
-            ray = []
-            for c in range(col+1, 8):
-                ray.append(row*8 + c)
-            rook_rays[square].append(ray)
-
-        return rook_rays
-    
-    def get_bishop_rays(self) -> List[List[List[int]]]:
-        bishop_rays = [[] for _ in range(64)]
-    
-        for square in range(64):
-            row, col = divmod(square, 8)
-
-            #NE
-            ray = []
-            r, c = row + 1, col + 1
-            while (r < 8 and c < 8):
-                ray.append(r*8 + c)
-                r += 1 
-                c += 1
-            bishop_rays[square].append(ray)
-
-            #SE
-            ray = []
-            r, c = row - 1, col + 1
-            while (r >= 0 and c < 8):
-                ray.append(r*8 + c)
-                r -= 1 
-                c += 1
-            bishop_rays[square].append(ray)
-            
-            #SW
-            ray = []
-            r, c = row - 1, col - 1
-            while (r >= 0 and c >= 0):
-                ray.append(r*8 + c)
-                r -= 1 
-                c -= 1
-            bishop_rays[square].append(ray)
-
-            #NW
-            ray = []
-            r, c = row + 1, col - 1
-            while (r < 8 and c >= 0):
-                ray.append(r*8 + c)
-                r += 1 
-                c -= 1
-            bishop_rays[square].append(ray)
-
-        return bishop_rays
-
     def get_sliding_moves(self, square, rays):
         moves = []
         piece = self.board[square]
@@ -496,22 +385,20 @@ class Game():
             return EMPTY
 
     def remove_piece(self, square: int):
-        place = 1 << square
-
-        #remove it from all
-        self.white_pieces &= ~place
-        self.black_pieces &= ~place
-        self.white_pawns &= ~place 
-        self.black_pawns &= ~place 
-        self.white_bishops &= ~place 
-        self.black_bishops &= ~place 
-        self.white_knights &= ~place
-        self.black_knights &= ~place
-        self.white_rooks &= ~place 
-        self.black_rooks &= ~place 
-        self.white_queens &= ~place
-        self.black_queens &= ~place
-
+        piece = self.board[square]
+        if piece == EMPTY:
+            return
+        place = ~(1 << square)
+        self.bitboards[PIECE_INDEX[piece]] &= place
+        self.material -= PIECE_MATERIAL[piece]
+        self.phase -= PIECE_PHASES[piece]
+        self.pawn_key ^= PAWN_KEYS[piece][square]
+        self.pst_midgame -= PST_MIDGAME[piece][square]
+        self.pst_endgame -= PST_ENDGAME[piece][square]
+        if piece & WHITE:
+            self.white_pieces &= place
+        else:
+            self.black_pieces &= place
         self.board[square] = EMPTY
 
     def change_turn(self):
@@ -569,132 +456,142 @@ class Game():
 
 
 #PSEUDO LEGAL MOVE GENERATION ################################################
-    def generate_white_pawn_moves(self):
+    def generate_white_pawn_moves(self, kind=GEN_ALL):
         moves = []
         occupied = self.white_pieces | self.black_pieces
-        opponents = self.black_pieces
+        opponents = self.black_pieces if kind != GEN_QUIET else EMPTY_BITBOARD
+        ep_target = self.ep_target if kind != GEN_QUIET else None
 
-        for square in self.bb_iterate(self.white_pawns):
+        for square in self.bb_iterate(self.bitboards[WHITE_PAWNS]):
             target = self.pawn_pushes_white[square]
             if target != -1 and not (occupied & (1 << target)):
                 targ_row = target // 8
                 if targ_row == 0:
-                    for promotion in [BISHOP, KNIGHT, ROOK, QUEEN]:
-                        moves.append((square, target, promotion | WHITE))
-                else:
-                    moves.append((square, target, None))
+                    if kind != GEN_QUIET:
+                        for promotion in PROMOTIONS:
+                            moves.append(square | (target << END_SHIFT) | ((promotion | WHITE) << PROMOTION_SHIFT))
+                elif kind != GEN_NOISY:
+                    moves.append(square | (target << END_SHIFT))
                     dtarget = self.pawn_double_pushes_white[square]
                     if dtarget != -1 and not (occupied & (1 << dtarget)):
-                        moves.append((square, dtarget, None))
+                        moves.append(square | (dtarget << END_SHIFT) | DOUBLE_PUSH_FLAG)
 
             #captures 
             caps = self.pawn_attacks_white[square] & opponents 
             for target in self.bb_iterate(caps):
                 targ_row = target // 8
                 if targ_row == 0:
-                    for promotion in [BISHOP, KNIGHT, ROOK, QUEEN]:
-                        moves.append((square, target, promotion | WHITE))
+                    for promotion in PROMOTIONS:
+                        moves.append(square | (target << END_SHIFT) | ((promotion | WHITE) << PROMOTION_SHIFT) | CAPTURE_FLAG)
                 else:
-                    moves.append((square, target, None))
+                    moves.append(square | (target << END_SHIFT) | CAPTURE_FLAG)
 
             #enpessant
-            if self.ep_target is not None:
-                ep_bit = 1 << self.ep_target
+            if ep_target is not None:
+                ep_bit = 1 << ep_target
                 if (self.pawn_attacks_white[square] & ep_bit) != 0:
-                    moves.append((square, self.ep_target, None))
+                    moves.append(square | (ep_target << END_SHIFT) | CAPTURE_FLAG | EP_FLAG)
         return moves
 
-    def generate_black_pawn_moves(self):
+    def generate_black_pawn_moves(self, kind=GEN_ALL):
         moves = []
         occupied = self.white_pieces | self.black_pieces
-        opponents = self.white_pieces
+        opponents = self.white_pieces if kind != GEN_QUIET else EMPTY_BITBOARD
+        ep_target = self.ep_target if kind != GEN_QUIET else None
 
-        for square in self.bb_iterate(self.black_pawns):
+        for square in self.bb_iterate(self.bitboards[BLACK_PAWNS]):
             target = self.pawn_pushes_black[square]
             if target != -1 and not (occupied & (1 << target)):
                 targ_row = target // 8
                 if targ_row == 7:
-                    for promotion in [BISHOP, KNIGHT, ROOK, QUEEN]:
-                        moves.append((square, target, promotion | BLACK))
-                else:
-                    moves.append((square, target, None))
+                    if kind != GEN_QUIET:
+                        for promotion in PROMOTIONS:
+                            moves.append(square | (target << END_SHIFT) | ((promotion | BLACK) << PROMOTION_SHIFT))
+                elif kind != GEN_NOISY:
+                    moves.append(square | (target << END_SHIFT))
                     dtarget = self.pawn_double_pushes_black[square]
                     if dtarget != -1 and not (occupied & (1 << dtarget)):
-                        moves.append((square, dtarget, None))
+                        moves.append(square | (dtarget << END_SHIFT) | DOUBLE_PUSH_FLAG)
 
             #captures 
             caps = self.pawn_attacks_black[square] & opponents
             for target in self.bb_iterate(caps):
                 targ_row = target // 8
                 if targ_row == 7:
-                    for promotion in [BISHOP, KNIGHT, ROOK, QUEEN]:
-                        moves.append((square, target, promotion | BLACK))
+                    for promotion in PROMOTIONS:
+                        moves.append(square | (target << END_SHIFT) | ((promotion | BLACK) << PROMOTION_SHIFT) | CAPTURE_FLAG)
                 else:
-                    moves.append((square, target, None))
+                    moves.append(square | (target << END_SHIFT) | CAPTURE_FLAG)
 
             #enpessant
-            if self.ep_target is not None:
-                ep_bit = 1 << self.ep_target
+            if ep_target is not None:
+                ep_bit = 1 << ep_target
                 if (self.pawn_attacks_black[square] & ep_bit) != 0:
-                    moves.append((square, self.ep_target, None))
+                    moves.append(square | (ep_target << END_SHIFT) | CAPTURE_FLAG | EP_FLAG)
         return moves
 
 
-    def generate_knight_moves(self, colour):
+    def generate_knight_moves(self, colour, mask=None):
         moves = []
         my_bb = self.white_pieces if colour == WHITE else self.black_pieces
-        knights = self.white_knights if colour == WHITE else self.black_knights
+        opponents = self.black_pieces if colour == WHITE else self.white_pieces
+        knights = self.bitboards[PIECE_INDEX[colour | KNIGHT]]
+        if mask is None:
+            mask = ~my_bb #cancel out own squares
         for square in self.bb_iterate(knights):
-            targets = self.knight_moves[square] & ~my_bb #cancel out own squares
-            for target in self.bb_iterate(targets):
-                moves.append((square, target, None))
+            targets = self.knight_moves[square] & mask
+            self.add_moves(moves, square, targets, opponents)
         return moves
 
-    def generate_king_moves(self, colour):
+    def generate_king_moves(self, colour, mask=None):
         moves = []
         my_bb = self.white_pieces if colour == WHITE else self.black_pieces
+        opponents = self.black_pieces if colour == WHITE else self.white_pieces
         king = self.white_king if colour == WHITE else self.black_king
-        targets = self.king_moves[king] & ~my_bb
-        for target in self.bb_iterate(targets):
-            moves.append((king, target, None))
+        if mask is None:
+            mask = ~my_bb
+        targets = self.king_moves[king] & mask
+        self.add_moves(moves, king, targets, opponents)
 
         return moves
     
-    def generate_sliding_moves(self, square, rays, my_bb):
+    def add_moves(self, moves, square, targets, opponents):
+        """append a move from square to each of the targets"""
+        for target in self.bb_iterate(targets & opponents):
+            moves.append(square | (target << END_SHIFT) | CAPTURE_FLAG)
+        for target in self.bb_iterate(targets & ~opponents):
+            moves.append(square | (target << END_SHIFT))
+
+    def generate_sliding_moves(self, square, attacks, my_bb, mask=None):
         moves = []
         occupied = self.black_pieces | self.white_pieces
-        for ray in rays[square]:
-            for target in ray:
-                bit = 1 << target
-                if (my_bb & bit) == 0: #if the square is not occupied by our own we can take
-                    moves.append((square, target, None))
-                if (occupied & bit): #if the square is non empty, we cannot go further
-                    break
+        if mask is None:
+            mask = ~my_bb #cancel out own squares
+        self.add_moves(moves, square, attacks(square, occupied) & mask, occupied & ~my_bb)
         return moves
     
-    def generate_bishop_moves(self, colour):
+    def generate_bishop_moves(self, colour, mask=None):
         moves = []
-        bishops = self.white_bishops if colour == WHITE else self.black_bishops
+        bishops = self.bitboards[PIECE_INDEX[colour | BISHOP]]
         own = self.white_pieces if colour == WHITE else self.black_pieces
         for square in self.bb_iterate(bishops):
-            moves.extend(self.generate_sliding_moves(square, self.bishop_rays, own))
+            moves.extend(self.generate_sliding_moves(square, bishop_attacks, own, mask))
         return moves
 
-    def generate_rook_moves(self, colour):
+    def generate_rook_moves(self, colour, mask=None):
         moves = []
-        rooks = self.white_rooks if colour == WHITE else self.black_rooks
+        rooks = self.bitboards[PIECE_INDEX[colour | ROOK]]
         own = self.white_pieces if colour == WHITE else self.black_pieces
         for square in self.bb_iterate(rooks):
-            moves.extend(self.generate_sliding_moves(square, self.rook_rays, own))
+            moves.extend(self.generate_sliding_moves(square, rook_attacks, own, mask))
         return moves
     
-    def generate_queen_moves(self, colour):
+    def generate_queen_moves(self, colour, mask=None):
         moves = []
-        queens = self.white_queens if colour == WHITE else self.black_queens
-        occ = self.white_pieces | self.black_pieces
+        queens = self.bitboards[PIECE_INDEX[colour | QUEEN]]
         own = self.white_pieces if colour == WHITE else self.black_pieces
         for square in self.bb_iterate(queens):
-            moves.extend(self.generate_sliding_moves(square, self.queen_rays, own))
+            moves.extend(self.generate_sliding_moves(square, queen_attacks, own, mask))
         return moves
 
     def generate_castling_moves(self, colour):
@@ -703,161 +600,219 @@ class Game():
         row = 7 if colour == WHITE else 0
         oposite_colour = WHITE if colour == BLACK else BLACK
 
+        occupied = self.white_pieces | self.black_pieces
+
         # King-side castling
         if self.right_to_castle(king_square, king_square + 2):
-            squares_between = [king_square + 1, king_square + 2]
-            if self.board[king_square + 3] == ROOK | colour and all(self.board[sq] == EMPTY for sq in squares_between):
+            if self.board[king_square + 3] == ROOK | colour and not (BETWEEN[king_square][king_square + 3] & occupied):
                 if not any(self.is_square_attacked(sq, oposite_colour) for sq in [king_square, king_square + 1, king_square + 2]):
-                    moves.append((king_square, king_square + 2, None))
+                    moves.append(king_square | ((king_square + 2) << END_SHIFT) | CASTLE_FLAG)
 
         # Queen-side castling
         if self.right_to_castle(king_square, king_square - 2):
-            squares_between = [king_square - 1, king_square - 2, king_square - 3]
-            if self.board[king_square - 4] == ROOK | colour and all(self.board[sq] == EMPTY for sq in squares_between):  # last square can hold rook
+            if self.board[king_square - 4] == ROOK | colour and not (BETWEEN[king_square][king_square - 4] & occupied):
                 if not any(self.is_square_attacked(sq, oposite_colour) for sq in [king_square, king_square - 1, king_square - 2]):
-                    moves.append((king_square, king_square - 2, None))
+                    moves.append(king_square | ((king_square - 2) << END_SHIFT) | CASTLE_FLAG)
 
         return moves
 
-    def generate_all_moves(self, colour):
+    def generate_all_moves(self, colour, kind=GEN_ALL):
+        """Generate the pseudo legal moves of the given kind (GEN_ALL, GEN_NOISY or GEN_QUIET)"""
         moves = []
+        own = self.white_pieces if colour == WHITE else self.black_pieces
+        if kind == GEN_NOISY:
+            mask = self.black_pieces if colour == WHITE else self.white_pieces
+        elif kind == GEN_QUIET:
+            mask = ~(self.white_pieces | self.black_pieces)
+        else:
+            mask = ~own
+
         if colour == WHITE:
-            moves.extend(self.generate_white_pawn_moves())
+            moves.extend(self.generate_white_pawn_moves(kind))
         else:
-            moves.extend(self.generate_black_pawn_moves())
+            moves.extend(self.generate_black_pawn_moves(kind))
 
-        moves.extend(self.generate_bishop_moves(colour))
-        moves.extend(self.generate_knight_moves(colour))
-        moves.extend(self.generate_rook_moves(colour))
-        moves.extend(self.generate_queen_moves(colour))
-        moves.extend(self.generate_king_moves(colour))
-        moves.extend(self.generate_castling_moves(colour))
+        moves.extend(self.generate_bishop_moves(colour, mask))
+        moves.extend(self.generate_knight_moves(colour, mask))
+        moves.extend(self.generate_rook_moves(colour, mask))
+        moves.extend(self.generate_queen_moves(colour, mask))
+        moves.extend(self.generate_king_moves(colour, mask))
+        if kind != GEN_NOISY:
+            moves.extend(self.generate_castling_moves(colour))
 
         return moves
 
+    def generate_piece_moves(self, square):
+        """Generate the pseudo legal moves of the piece on square"""
+        piece = self.board[square]
+        colour = get_colour(piece)
+        piece_type = strip_piece(piece)
+        own = self.white_pieces if colour == WHITE else self.black_pieces
+        if piece_type == PAWN:
+            pawn_moves = self.generate_white_pawn_moves() if colour == WHITE else self.generate_black_pawn_moves()
+            return [move for move in pawn_moves if move & MOVE_SQUARE == square]
+        if piece_type == KNIGHT:
+            moves = []
+            self.add_moves(moves, square, self.knight_moves[square] & ~own, self.white_pieces ^ self.black_pieces ^ own)
+            return moves
+        if piece_type == BISHOP:
+            return self.generate_sliding_moves(square, bishop_attacks, own)
+        if piece_type == ROOK:
+            return self.generate_sliding_moves(square, rook_attacks, own)
+        if piece_type == QUEEN:
+            return self.generate_sliding_moves(square, queen_attacks, own)
+        if piece_type == KING:
+            return self.generate_king_moves(colour) + self.generate_castling_moves(colour)
+        return []
+
     def is_square_attacked(self, square, opp_colour):
 
         #pawn attacks
         if opp_colour == WHITE:
-            if (self.pawn_attacks_black[square] & self.white_pawns) != 0:
+            if (self.pawn_attacks_black[square] & self.bitboards[WHITE_PAWNS]) != 0:
                 return True
         if opp_colour == BLACK:
-            if (self.pawn_attacks_white[square] & self.black_pawns) != 0:
+            if (self.pawn_attacks_white[square] & self.bitboards[BLACK_PAWNS]) != 0:
                 return True
 
         #knight attacks
-        if (self.knight_moves[square] & (self.white_knights if opp_colour == WHITE else self.black_knights)) != 0:
+        if self.knight_moves[square] & self.bitboards[PIECE_INDEX[opp_colour | KNIGHT]]:
             return True
 
         #king attacks
-        if (self.king_moves[square] & ( (1 << self.white_king) if opp_colour == WHITE else (1 << self.black_king)) != 0):
+        if self.king_moves[square] & self.bitboards[PIECE_INDEX[opp_colour | KING]]:
             return True
 
         occupied = self.white_pieces | self.black_pieces
         #diagonal attacks
-        for ray in self.bishop_rays[square]:
-            for target in ray:
-                bit = 1 << target
-                if (occupied & bit):
-                    options = (self.white_bishops | self.white_queens) if opp_colour == WHITE else (self.black_bishops | self.black_queens)
-                    if (options & bit):
-                        return True
-                    break
+        options = (self.bitboards[PIECE_INDEX[opp_colour | BISHOP]] | self.bitboards[PIECE_INDEX[opp_colour | QUEEN]])
+        if bishop_attacks(square, occupied) & options:
+            return True
         #orthogonal attacks
-        for ray in self.rook_rays[square]:
-            for target in ray:
-                bit = 1 << target
-                if (occupied & bit):
-                    options = (self.white_rooks | self.white_queens) if opp_colour == WHITE else (self.black_rooks | self.black_queens)
-                    if (options & bit):
-                        return True
-                    break
+        options = (self.bitboards[PIECE_INDEX[opp_colour | ROOK]] | self.bitboards[PIECE_INDEX[opp_colour | QUEEN]])
+        if rook_attacks(square, occupied) & options:
+            return True
 
         return False
 
-    
-    def get_attack_rays(self, square, opp_colour):
+    def attackers_to(self, square, opp_colour):
+        """Return a bitboard of opp_colour's pieces attacking square"""
+        occupied = self.white_pieces | self.black_pieces
+        if opp_colour == WHITE:
+            return ((self.pawn_attacks_black[square] & self.bitboards[WHITE_PAWNS])
+                    | (self.knight_moves[square] & self.bitboards[WHITE_KNIGHTS])
+                    | (self.king_moves[square] & self.bitboards[WHITE_KINGS])
+                    | (bishop_attacks(square, occupied) & (self.bitboards[WHITE_BISHOPS] | self.bitboards[WHITE_QUEENS]))
+                    | (rook_attacks(square, occupied) & (self.bitboards[WHITE_ROOKS] | self.bitboards[WHITE_QUEENS])))
+        return ((self.pawn_attacks_white[square] & self.bitboards[BLACK_PAWNS])
+                | (self.knight_moves[square] & self.bitboards[BLACK_KNIGHTS])
+                | (self.king_moves[square] & self.bitboards[BLACK_KINGS])
+                | (bishop_attacks(square, occupied) & (self.bitboards[BLACK_BISHOPS] | self.bitboards[BLACK_QUEENS]))
+                | (rook_attacks(square, occupied) & (self.bitboards[BLACK_ROOKS] | self.bitboards[BLACK_QUEENS])))
+
+    def all_attackers_to(self, square, occupied):
+        """Return a bitboard of both sides' pieces attacking square, with
+        sliders seeing through everything not in occupied"""
+        bitboards = self.bitboards
+        return ((self.pawn_attacks_black[square] & bitboards[WHITE_PAWNS])
+                | (self.pawn_attacks_white[square] & bitboards[BLACK_PAWNS])
+                | (self.knight_moves[square] & (bitboards[WHITE_KNIGHTS] | bitboards[BLACK_KNIGHTS]))
+                | (self.king_moves[square] & (bitboards[WHITE_KINGS] | bitboards[BLACK_KINGS]))
+                | (bishop_attacks(square, occupied) & (bitboards[WHITE_BISHOPS] | bitboards[BLACK_BISHOPS]
+                                                       | bitboards[WHITE_QUEENS] | bitboards[BLACK_QUEENS]))
+                | (rook_attacks(square, occupied) & (bitboards[WHITE_ROOKS] | bitboards[BLACK_ROOKS]
+                                                     | bitboards[WHITE_QUEENS] | bitboards[BLACK_QUEENS])))
+
+    def see(self, move):
         """
-        returns a list of rays. This represents the squares that, if they 
-        become occupied by another piece, will block an attack on the piece 
-        occupying square.
+        Static exchange evaluation: the material the side making move wins
+        (negative if it loses material) when both sides keep recapturing on
+        the target square, always with their least valuable piece, and each
+        side stops as soon as carrying on would lose it more. Pins are ignored.
         """
-        rays = []
-
-        # pawn attacks
-        if opp_colour == WHITE:
-            if (bb := self.pawn_attacks_black[square] & self.white_pawns) != 0:
-                rays.append(bb) # the square number
-        if opp_colour == BLACK:
-            if (bb := self.pawn_attacks_white[square] & self.black_pawns) != 0:
-                rays.append(bb)
-
-        # knight attacks
-        if (bb := self.knight_moves[square] & (self.white_knights if opp_colour == WHITE else self.black_knights)) != 0:
-            rays.append(bb)
-
-        # king attacks
-        if (bb := self.king_moves[square] & ((1 << self.white_king) if opp_colour == WHITE else (1 << self.black_king))) != 0:
-            rays.append(bb)
-
-
-        occupied = self.white_pieces | self.black_pieces
-        # diagonal attacks
-        for ray in self.bishop_rays[square]:
-            for idx, target in enumerate(ray):
-                bit = 1 << target
-                if (occupied & bit):
-                    options = (self.white_bishops | self.white_queens) if opp_colour == WHITE else (self.black_bishops | self.black_queens)
-                    if (options & bit):
-                        rays.append(make_bit_board(*ray[:idx+1]))
-                    break
-
-        # orthogonal attacks
-        for ray in self.rook_rays[square]:
-            for idx, target in enumerate(ray):
-                bit = 1 << target
-                if (occupied & bit):
-                    options = (self.white_rooks | self.white_queens) if opp_colour == WHITE else (self.black_rooks | self.black_queens)
-                    if (options & bit):
-                        rays.append(make_bit_board(*ray[:idx+1]))
+        start = move & MOVE_SQUARE
+        end = (move >> END_SHIFT) & MOVE_SQUARE
+        if move & CASTLE_FLAG:
+            return 0
+        board = self.board
+        bitboards = self.bitboards
+        occupied = (self.white_pieces | self.black_pieces) ^ (1 << start)
+        colour = self.turn
+
+        if move & EP_FLAG:
+            gain = PIECE_VALS[PAWN]
+            occupied ^= 1 << (end + (8 if colour == WHITE else -8))
+        else:
+            gain = PIECE_VALS[strip_piece(board[end])] if board[end] else 0
+        promotion = (move >> PROMOTION_SHIFT) & MOVE_PROMOTION
+        if promotion:
+            gain += PIECE_VALS[strip_piece(promotion)] - PIECE_VALS[PAWN]
+            on_square = PIECE_VALS[strip_piece(promotion)]
+        else:
+            on_square = PIECE_VALS[strip_piece(board[start])]
+
+        diagonal = (bitboards[WHITE_BISHOPS] | bitboards[BLACK_BISHOPS]
+                    | bitboards[WHITE_QUEENS] | bitboards[BLACK_QUEENS])
+        straight = (bitboards[WHITE_ROOKS] | bitboards[BLACK_ROOKS]
+                    | bitboards[WHITE_QUEENS] | bitboards[BLACK_QUEENS])
+        attackers = self.all_attackers_to(end, occupied) & occupied
+        # gains[i] is what the side making the i-th capture has won so far
+        gains = [gain]
+        while True:
+            colour = BLACK if colour == WHITE else WHITE
+            own = attackers & (self.white_pieces if colour == WHITE else self.black_pieces)
+            if not own:
+                break
+            for piece_type in SEE_ORDER:
+                candidates = own & bitboards[PIECE_INDEX[colour | piece_type]]
+                if candidates:
                     break
+            if piece_type == KING and attackers & ~own:
+                break # the king can't take into a defended square
+            gains.append(on_square - gains[-1])
+            on_square = PIECE_VALS[piece_type]
+            occupied ^= candidates & -candidates
+            # sliders lined up behind the piece that just captured join in
+            if piece_type != KNIGHT and piece_type != KING:
+                attackers |= ((bishop_attacks(end, occupied) & diagonal)
+                              | (rook_attacks(end, occupied) & straight))
+            attackers &= occupied
+
+        # each side can stop instead of recapturing, if that is better
+        for i in range(len(gains) - 1, 0, -1):
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
 
-        return rays
-    
     def move_piece(self, move):
-        start, end, promotion = move
+        """Make the (packed) move, returning the packed state needed to undo it"""
+        start = move & MOVE_SQUARE
+        end = (move >> END_SHIFT) & MOVE_SQUARE
+        promotion = (move >> PROMOTION_SHIFT) & MOVE_PROMOTION
         piece = self.board[start]
-        piece_type = strip_piece(piece)
+        turn = self.turn
 
         #if enpessant:
-        if piece_type == PAWN and self.ep_target is not None and end == self.ep_target:
-            cap_row = end // 8 + (1 if self.turn == WHITE else -1)
-            captured_square = cap_row * 8 + (end % 8)
-            captured_piece = self.board[captured_square]
+        if move & EP_FLAG:
+            captured_square = end + (8 if turn == WHITE else -8)
         else:
-            captured_piece = self.board[end]
-            captured_square = end if captured_piece != EMPTY else None
+            captured_square = end
+        captured_piece = self.board[captured_square]
 
+        undo = (captured_piece
+                | (self.castling << UNDO_CASTLING_SHIFT)
+                | ((NO_EP if self.ep_target is None else self.ep_target) << UNDO_EP_SHIFT)
+                | (self.halfs << UNDO_HALFS_SHIFT)
+                | (self.zobrist << UNDO_ZOBRIST_SHIFT))
 
-        zobrist = self.zobrist
-        castling = self.castling
-        ep_target = self.ep_target
-        halfs = self.halfs
-        fulls = self.fulls
-        turn = self.turn
-        castle = None
+        self.check_info_stack.append(self.check_info)
+        self.check_info = None
 
-        self.update_castle_rights(start)
+        if self.castling:
+            self.update_castle_rights(start)
 
-        if captured_square is not None:
+        if captured_piece != EMPTY:
             self.remove_piece(captured_square)
-
-        self.remove_piece(start)
-
-        #promotions
-        self.set_piece(end, promotion) if promotion else self.set_piece(end, piece)
-
-        if captured_piece is not None and captured_piece != EMPTY:
+            self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[captured_piece]][captured_square]
             if get_colour(captured_piece) == WHITE:
                 self.white_captured_list.append(captured_piece)
                 self.white_captured_list.sort()
@@ -865,189 +820,301 @@ class Game():
                 self.black_captured_list.append(captured_piece)
                 self.black_captured_list.sort()
 
+        self.remove_piece(start)
+
+        #promotions
+        placed = promotion if promotion else piece
+        self.set_piece(end, placed)
+        self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[piece]][start]
+        self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[placed]][end]
 
         #castles
-        if piece_type == KING and (end - start) == 2:
-            castle = 'K_CASTLE'
-            if self.turn == WHITE:
-                self.set_piece(WHITE_KING_START + 1, ROOK | WHITE)
-                self.remove_piece(WHITE_KING_START + 3)
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | WHITE]][WHITE_KING_START + 3]
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | WHITE]][WHITE_KING_START + 1]
-            else:
-                self.set_piece(BLACK_KING_START + 1, ROOK | BLACK)
-                self.remove_piece(BLACK_KING_START + 3)
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | BLACK]][BLACK_KING_START + 3]
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | BLACK]][BLACK_KING_START + 1]
-        elif piece_type == KING and (end - start) == -2:
-            castle = 'Q_CASTLE'
-            if self.turn == WHITE:
-                self.set_piece(WHITE_KING_START - 1, ROOK | WHITE)
-                self.remove_piece(WHITE_KING_START - 4)
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | WHITE]][WHITE_KING_START - 4]
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | WHITE]][WHITE_KING_START - 1]
+        if move & CASTLE_FLAG:
+            rook = ROOK | turn
+            if end > start:
+                rook_start, rook_end = start + 3, start + 1
             else:
-                self.set_piece(BLACK_KING_START - 1, ROOK | BLACK)
-                self.remove_piece(BLACK_KING_START - 4)
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | BLACK]][BLACK_KING_START - 4]
-                self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[ROOK | BLACK]][BLACK_KING_START - 1]
-
-        if piece_type == PAWN and abs(end - start) == 16:
-            if self.ep_target is not None:
-                self.zobrist ^= ZOBRIST_EP[self.ep_target % 8]
+                rook_start, rook_end = start - 4, start - 1
+            self.remove_piece(rook_start)
+            self.set_piece(rook_end, rook)
+            self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[rook]][rook_start]
+            self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[rook]][rook_end]
+
+        if self.ep_target is not None:
+            self.zobrist ^= ZOBRIST_EP[self.ep_target % 8]
+        if move & DOUBLE_PUSH_FLAG:
             self.ep_target = (start + end) // 2
             self.zobrist ^= ZOBRIST_EP[self.ep_target % 8]
         else:
             self.ep_target = None
 
-        self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[piece]][start]
-        self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[piece]][end]
+        self.change_turn()
+        self.zobrist ^= ZOBRIST_SIDE
 
-        if captured_piece is not None and captured_piece != EMPTY:
-            self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[captured_piece]][end]
-
-        if promotion:
-            self.zobrist ^= ZOBRIST_PIECE[PIECE_INDEX[promotion]][end]
+        return undo
 
 
+    def make_null_move(self):
+        """Pass the turn without moving, returning the packed state needed to undo it"""
+        undo = (((NO_EP if self.ep_target is None else self.ep_target) << UNDO_EP_SHIFT)
+                | (self.zobrist << UNDO_ZOBRIST_SHIFT))
+        if self.ep_target is not None:
+            self.zobrist ^= ZOBRIST_EP[self.ep_target % 8]
+            self.ep_target = None
+        self.check_info_stack.append(self.check_info)
+        self.check_info = None
         self.change_turn()
         self.zobrist ^= ZOBRIST_SIDE
+        return undo
 
+    def unmake_null_move(self, old_state):
+        self.check_info = self.check_info_stack.pop()
+        self.change_turn()
+        ep_target = (old_state >> UNDO_EP_SHIFT) & UNDO_EP
+        self.ep_target = None if ep_target == NO_EP else ep_target
+        self.zobrist = old_state >> UNDO_ZOBRIST_SHIFT
 
-        return (start, end, piece, captured_piece, captured_square, castling, ep_target, halfs, fulls, turn, promotion, castle, zobrist)
-
+    def has_non_pawn_material(self, colour):
+        """True if colour has a piece other than pawns and the king"""
+        if colour == WHITE:
+            return bool(self.bitboards[WHITE_KNIGHTS] | self.bitboards[WHITE_BISHOPS] | self.bitboards[WHITE_ROOKS] | self.bitboards[WHITE_QUEENS])
+        return bool(self.bitboards[BLACK_KNIGHTS] | self.bitboards[BLACK_BISHOPS] | self.bitboards[BLACK_ROOKS] | self.bitboards[BLACK_QUEENS])
 
     def unmake_move(self, move, old_state):
         """
-        Restore board to previous state using the dictionary returned by move_piece.
+        Restore board to previous state using the packed state returned by move_piece.
         """
-        start, end, piece, captured_piece, captured_square, castling, ep_target, halfs, fulls, old_turn, promotion, castle, zobrist = old_state
+        start = move & MOVE_SQUARE
+        end = (move >> END_SHIFT) & MOVE_SQUARE
+        self.change_turn()
+        turn = self.turn
 
+        piece = (PAWN | turn) if move & (MOVE_PROMOTION << PROMOTION_SHIFT) else self.board[end]
         self.remove_piece(end)
         self.set_piece(start, piece)
 
-        if captured_square is not None and captured_piece != EMPTY:
-            self.set_piece(captured_square, captured_piece)
+        captured_piece = old_state & UNDO_PIECE
+        if captured_piece != EMPTY:
+            if move & EP_FLAG:
+                self.set_piece(end + (8 if turn == WHITE else -8), captured_piece)
+            else:
+                self.set_piece(end, captured_piece)
+            if captured_piece in self.white_captured_list:
+                self.white_captured_list.remove(captured_piece)
+            elif captured_piece in self.black_captured_list:
+                self.black_captured_list.remove(captured_piece)
 
         #castling
-        if castle == 'K_CASTLE':
-            if old_turn == WHITE:
-                self.remove_piece(WHITE_KING_START + 1)  # clear f1
-                self.set_piece(WHITE_KING_START + 3, ROOK | WHITE)  # put rook back on h1
+        if move & CASTLE_FLAG:
+            if end > start:
+                self.remove_piece(start + 1)  # clear f1
+                self.set_piece(start + 3, ROOK | turn)  # put rook back on h1
             else:
-                self.remove_piece(BLACK_KING_START + 1)
-                self.set_piece(BLACK_KING_START + 3, ROOK | BLACK)
-        elif castle == 'Q_CASTLE':
-            if old_turn == WHITE:
-                self.remove_piece(WHITE_KING_START - 1)  # clear d1
-                self.set_piece(WHITE_KING_START - 4, ROOK | WHITE)  # put rook back on a1
-            else:
-                self.remove_piece(BLACK_KING_START - 1)
-                self.set_piece(BLACK_KING_START - 4, ROOK | BLACK)
+                self.remove_piece(start - 1)  # clear d1
+                self.set_piece(start - 4, ROOK | turn)  # put rook back on a1
 
-        if captured_piece in self.white_captured_list:
-            self.white_captured_list.remove(captured_piece)
-        elif captured_piece in self.black_captured_list:
-            self.black_captured_list.remove(captured_piece)
+        # Restore meta state
+        self.castling = (old_state >> UNDO_CASTLING_SHIFT) & ALL
+        ep_target = (old_state >> UNDO_EP_SHIFT) & UNDO_EP
+        self.ep_target = None if ep_target == NO_EP else ep_target
+        self.halfs = (old_state >> UNDO_HALFS_SHIFT) & UNDO_HALFS
+        self.zobrist = old_state >> UNDO_ZOBRIST_SHIFT
+        self.check_info = self.check_info_stack.pop()
+
+    def generate_evasions(self, colour, info, kind=GEN_ALL):
+        """Generate the pseudo legal moves of the given kind that might get
+        colour out of check: king moves, and with a single checker, captures
+        of it and interpositions on the squares between it and the king"""
+        own = self.white_pieces if colour == WHITE else self.black_pieces
+        if kind == GEN_NOISY:
+            mask = self.black_pieces if colour == WHITE else self.white_pieces
+        elif kind == GEN_QUIET:
+            mask = ~(self.white_pieces | self.black_pieces)
+        else:
+            mask = ~own
 
+        moves = self.generate_king_moves(colour, mask)
+        checkers = info.checkers
+        if checkers & (checkers - 1):
+            return moves # double check, only the king can move
 
-        # Restore meta state
-        self.castling = castling
-        self.ep_target = ep_target
-        self.halfs = halfs
-        self.fulls = fulls
-        self.turn = old_turn
-        self.zobrist = zobrist
-
-    def check_legality(self, move, king_threats, attacks, pins, opp_colour):
-        """
-        In move generation, we can perform a number of legality checks which allow 
-        us to skip a move, speeding up runtime.
-        """
-        start, end, prom = move
-        piece = self.board[start]
+        mask &= info.block_mask
+        # pawn moves are left to the legality check, which also has to look
+        # at en passant captures of a checking pawn
+        if colour == WHITE:
+            moves.extend(self.generate_white_pawn_moves(kind))
+        else:
+            moves.extend(self.generate_black_pawn_moves(kind))
+        moves.extend(self.generate_bishop_moves(colour, mask))
+        moves.extend(self.generate_knight_moves(colour, mask))
+        moves.extend(self.generate_rook_moves(colour, mask))
+        moves.extend(self.generate_queen_moves(colour, mask))
+        return moves
 
-        #if we are the king, we cannot move into an attack, but any other move is fine
-        if piece == (self.turn | KING):
-            if attacks & (1 << end):
-                return False
-        
-        elif start in pins:
-            if not ((1 << end) & pins[start]):
-                return False
-
-        #if we are in check but not moving the king, we need to block the attack:
-        if king_threats:
-            #block the attack
-            n = len(king_threats)
-            assert (n >= 1) #this should be true as there should be some attack on the king because of the outer if
-            if not (n == 1 and ((1 << end) & king_threats[0])):
-                return False
-        
-        return True # passed: for now
+    def is_legal_ep(self, move, colour, king, checkers):
+        """An en passant capture takes two pawns off the capturing side's
+        rank, so pins and checks are worked out from scratch for it"""
+        start = move & MOVE_SQUARE
+        end = (move >> END_SHIFT) & MOVE_SQUARE
+        captured = end + 8 if colour == WHITE else end - 8
+        if colour == WHITE:
+            leapers = self.bitboards[BLACK_KNIGHTS] | self.bitboards[BLACK_PAWNS]
+            diagonal = self.bitboards[BLACK_BISHOPS] | self.bitboards[BLACK_QUEENS]
+            straight = self.bitboards[BLACK_ROOKS] | self.bitboards[BLACK_QUEENS]
+        else:
+            leapers = self.bitboards[WHITE_KNIGHTS] | self.bitboards[WHITE_PAWNS]
+            diagonal = self.bitboards[WHITE_BISHOPS] | self.bitboards[WHITE_QUEENS]
+            straight = self.bitboards[WHITE_ROOKS] | self.bitboards[WHITE_QUEENS]
+
+        # a knight or pawn check can only be answered by taking the pawn
+        if checkers & leapers & ~(1 << captured):
+            return False
+        occupied = ((self.white_pieces | self.black_pieces) ^ (1 << start) ^ (1 << captured)) | (1 << end)
+        return not (bishop_attacks(king, occupied) & diagonal or rook_attacks(king, occupied) & straight)
 
-    def generate_legal_moves(self, colour):
-        pseudo_moves = self.generate_all_moves(colour)
+    def generate_legal_moves(self, colour, kind=GEN_ALL):
+        info = self.get_check_info() if colour == self.turn else self.compute_check_info(colour)
+        if info.checkers:
+            pseudo_moves = self.generate_evasions(colour, info, kind)
+        else:
+            pseudo_moves = self.generate_all_moves(colour, kind)
 
         legal_moves = []
         king = self.white_king if colour == WHITE else self.black_king
-        attacks = self.get_attack_map(self.get_inverse_turn())
-        pins = self.get_pins(king, colour)
-        king_threats = self.get_attack_rays(king, self.get_inverse_turn())
+        # only needed for king moves, which captures-only generation rarely has
+        attacks = None
+        pinned = info.pinned
+        block_mask = info.block_mask
+        king_lines = LINE[king]
 
         for move in pseudo_moves:
-            start, end, prom = move
-            piece = self.board[start]
+            start = move & MOVE_SQUARE
+            end = (move >> END_SHIFT) & MOVE_SQUARE
 
             #if we are the king, we cannot move into an attack, but any other move is fine
             if start == king:
+                if attacks is None:
+                    attacks = self.get_enemy_attacks(info, colour)
                 if attacks & (1 << end):
                     continue
-            
-            elif start in pins:
-                if not (pins[start] & (1 << end)):
+
+            elif move & EP_FLAG:
+                if not self.is_legal_ep(move, colour, king, info.checkers):
                     continue
 
+            elif pinned & (1 << start) and not (king_lines[start] & (1 << end)):
+                continue
+
             #if we are in check but not moving the king, we need to block the attack:
-            elif king_threats:
-                #block the attack
-                n = len(king_threats)
-                if not (n == 1 and ((1 << end) & king_threats[0])):
-                    continue
+            #(a pinned piece moving along its pin still has to deal with the check)
+            elif not (block_mask & (1 << end)):
+                continue
             
             legal_moves.append(move)
 
         return legal_moves
+
+    def get_check_info(self):
+        """The CheckInfo of the side to move, worked out the first time it
+        is asked for in this position"""
+        info = self.check_info
+        if info is None:
+            info = self.check_info = self.compute_check_info(self.turn)
+        return info
+
+    def compute_check_info(self, colour):
+        opp_colour = BLACK if colour == WHITE else WHITE
+        king = self.white_king if colour == WHITE else self.black_king
+
+        checkers = self.attackers_to(king, opp_colour)
+        if not checkers:
+            block_mask = FULL_BITBOARD
+        elif checkers & (checkers - 1):
+            block_mask = EMPTY_BITBOARD # double check, only the king can move
+        else:
+            block_mask = checkers | BETWEEN[king][checkers.bit_length() - 1]
+
+        return CheckInfo(checkers, block_mask, self.get_pins(king, colour))
+
+    def get_check_squares(self, info, colour):
+        """For each piece type, the squares from which a piece of colour
+        would check the enemy king, kept on the CheckInfo"""
+        if info.check_squares is None:
+            opp_king = self.black_king if colour == WHITE else self.white_king
+            occupied = self.white_pieces | self.black_pieces
+            bishop_checks = bishop_attacks(opp_king, occupied)
+            rook_checks = rook_attacks(opp_king, occupied)
+            info.check_squares = [EMPTY_BITBOARD,
+                                  # a pawn checks from where an enemy pawn on the king's square would attack
+                                  self.pawn_attacks_black[opp_king] if colour == WHITE else self.pawn_attacks_white[opp_king],
+                                  self.knight_moves[opp_king],
+                                  bishop_checks,
+                                  rook_checks,
+                                  bishop_checks | rook_checks,
+                                  EMPTY_BITBOARD]
+        return info.check_squares
+
+    def get_enemy_attacks(self, info, colour):
+        """The squares attacked by colour's opponent, kept on the CheckInfo"""
+        if info.attacks is None:
+            info.attacks = self.get_attack_map(BLACK if colour == WHITE else WHITE)
+        return info.attacks
     
+    def is_valid_move(self, move):
+        """Check that a move from elsewhere (e.g. the transposition table) is
+        legal in this position, without generating every move"""
+        start = move & MOVE_SQUARE
+        piece = self.board[start]
+        if piece == EMPTY or get_colour(piece) != self.turn:
+            return False
+        if move not in self.generate_piece_moves(start):
+            return False
+        colour = self.turn
+        old_state = self.move_piece(move)
+        king = self.white_king if colour == WHITE else self.black_king
+        legal = not self.is_square_attacked(king, self.turn)
+        self.unmake_move(move, old_state)
+        return legal
+
     def piece_legal_moves(self, square):
         piece = self.board[square]
         colour = get_colour(piece)
-        return [move for move in self.generate_legal_moves(colour) if move[0] == square]
+        return [move for move in self.generate_legal_moves(colour) if move & MOVE_SQUARE == square]
+
+    def in_check(self, colour):
+        # reuse the CheckInfo if we have one, but it isn't worth making one
+        # just for this
+        if colour == self.turn and self.check_info is not None:
+            return bool(self.check_info.checkers)
+        king_square = self.white_king if colour == WHITE else self.black_king
+        return self.is_square_attacked(king_square, BLACK if colour == WHITE else WHITE)
+
+    def position_status(self):
+        """Generate the legal moves of the side to move once, and work out
+        from them whether it has been checkmated or stalemated"""
+        return PositionStatus(self.generate_legal_moves(self.turn), self.in_check(self.turn))
 
     def is_checkmate(self, colour):
-        if not self.generate_legal_moves(colour):
-            king_square = self.white_king if colour == WHITE else self.black_king
-            if self.is_square_attacked(king_square, BLACK if colour == WHITE else WHITE):
-                return True
-        return False
+        return not self.generate_legal_moves(colour) and self.in_check(colour)
 
     def is_stalemate(self, colour):
-        if not self.generate_legal_moves(colour):
-            king_square = self.white_king if colour == WHITE else self.black_king
-            if not self.is_square_attacked(king_square, BLACK if colour == WHITE else WHITE):
-                return True
-        return False
+        return not self.generate_legal_moves(colour) and not self.in_check(colour)
 
     # These are helper functions for our GUI/parser
 
     def legal_move(self, start, end):
         start = start[1]*8 + start[0]
         end = end[1]*8 + end[0]
+        return self.find_move(start, end) is not None
 
-        if self.is_promotion_move(end, start):
-            colour = get_colour(self.board[start])
-            return (start, end, BISHOP | colour) in self.generate_legal_moves(self.turn)
-        return (start, end, None) in self.generate_legal_moves(self.turn)
+    def find_move(self, start, end, promotion=None):
+        """Return the packed legal move from start to end, or None if there
+        isn't one. If promotion is None any promotion will match"""
+        for move in self.generate_legal_moves(self.turn):
+            if move & MOVE_SQUARE == start and (move >> END_SHIFT) & MOVE_SQUARE == end:
+                if promotion is None or move_promotion(move) == promotion:
+                    return move
+        return None
 
     def is_empty(self, square):
         return self.board[square] == EMPTY
@@ -1068,222 +1135,179 @@ class Game():
     def get_inverse_turn(self):
         return WHITE if self.turn == BLACK else BLACK
 
-    def get_sliding_attack_map(self, square, colour, rays, occupied):
-        my_bb = self.white_pieces if colour == WHITE else self.black_pieces
+    def get_sliding_attack_map(self, square, colour, attacks, occupied):
+        # the enemy king does not block our attacks, otherwise it could step
+        # back along the line it is being attacked on
         king = self.white_king if colour == BLACK else self.black_king
-        bb = 0
-        for ray in rays[square]:
-            for target in ray:
-                if target == king:
-                    continue
-                bit = 1 << target
-                if (my_bb & bit) == 0: #if the square is not occupied by our own we can take
-                    bb |= bit
-                if (occupied & bit): #if the square is non empty, we cannot go further
-                    bb |= bit
-                    break
-        return bb
+        return attacks(square, occupied & ~(1 << king))
 
 
     def get_attack_map(self, colour):
         map = EMPTY_BITBOARD
 
         #Knight moves
-        for square in self.bb_iterate(self.white_knights if colour == WHITE else self.black_knights):
+        for square in self.bb_iterate(self.bitboards[PIECE_INDEX[colour | KNIGHT]]):
             map |= self.knight_moves[square]
 
         #King moves
         map |= self.king_moves[self.white_king if colour == WHITE else self.black_king]
 
         #Pawn attacks
-        for square in self.bb_iterate(self.white_pawns if colour == WHITE else self.black_pawns):
+        for square in self.bb_iterate(self.bitboards[PIECE_INDEX[colour | PAWN]]):
             map |= self.pawn_attacks_white[square] if colour == WHITE else self.pawn_attacks_black[square]
 
         #sliders
         occupied = self.white_pieces | self.black_pieces
 
-        for square in self.bb_iterate(self.white_bishops if colour == WHITE else self.black_bishops):
-            map |= self.get_sliding_attack_map(square, colour, self.bishop_rays, occupied)
+        for square in self.bb_iterate(self.bitboards[PIECE_INDEX[colour | BISHOP]]):
+            map |= self.get_sliding_attack_map(square, colour, bishop_attacks, occupied)
 
-        for square in self.bb_iterate(self.white_rooks if colour == WHITE else self.black_rooks):
-            map |= self.get_sliding_attack_map(square, colour, self.rook_rays, occupied)
+        for square in self.bb_iterate(self.bitboards[PIECE_INDEX[colour | ROOK]]):
+            map |= self.get_sliding_attack_map(square, colour, rook_attacks, occupied)
 
-        for square in self.bb_iterate(self.white_queens if colour == WHITE else self.black_queens):
-            map |= self.get_sliding_attack_map(square, colour, self.bishop_rays, occupied)
-            map |= self.get_sliding_attack_map(square, colour, self.rook_rays, occupied)
+        for square in self.bb_iterate(self.bitboards[PIECE_INDEX[colour | QUEEN]]):
+            map |= self.get_sliding_attack_map(square, colour, queen_attacks, occupied)
 
         return map
 
     def get_pins(self, king_square, colour):
         """
-        Return a dict of pinned pieces -> allowed ray squares.
-        Uses sliding attacks from opponent towards king.
+        Return a bitboard of colour's pieces pinned to its king. A pinned piece
+        is the only piece between the king and an enemy slider on the same line.
         """
-        pins = {}
+        own = self.white_pieces if colour == WHITE else self.black_pieces
+        if colour == WHITE:
+            diagonal = self.bitboards[BLACK_BISHOPS] | self.bitboards[BLACK_QUEENS]
+            straight = self.bitboards[BLACK_ROOKS] | self.bitboards[BLACK_QUEENS]
+        else:
+            diagonal = self.bitboards[WHITE_BISHOPS] | self.bitboards[WHITE_QUEENS]
+            straight = self.bitboards[WHITE_ROOKS] | self.bitboards[WHITE_QUEENS]
+        return self.get_blockers(king_square, diagonal, straight, own)
+
+    def get_blockers(self, king_square, diagonal, straight, own):
+        """Return a bitboard of the pieces in own that are the only piece
+        between king_square and one of the diagonal or straight sliders"""
+        blocking = EMPTY_BITBOARD
         occupied = self.white_pieces | self.black_pieces
-
-        def get_blockers(piece_type, rays):
-            for ray in rays:
-                blockers = []
-                for square in ray:
-                    piece = self.board[square]
-                    bit = 1 << square
-                    if occupied & bit:
-                        if get_colour(piece) == colour:
-                            blockers.append(square)
-                        else:
-                            # enemy piece
-                            if strip_piece(piece) in (piece_type, QUEEN) and len(blockers) == 1:
-                                # we found a pin
-                                pinned_sq = blockers[0]
-                                if pinned_sq in pins:
-                                    pins[pinned_sq] &= make_bit_board(*ray[:ray.index(square)+1])
-                                else:
-                                    pins[pinned_sq] = make_bit_board(*ray[:ray.index(square)+1])
-                            break
-
-        get_blockers(BISHOP, self.bishop_rays[king_square])
-        get_blockers(ROOK, self.rook_rays[king_square])
-        return pins
+        # the sliders that would attack the king on an empty board
+        snipers = ((bishop_attacks(king_square, EMPTY_BITBOARD) & diagonal)
+                   | (rook_attacks(king_square, EMPTY_BITBOARD) & straight))
+        between = BETWEEN[king_square]
+        for sniper in self.bb_iterate(snipers):
+            blockers = between[sniper] & occupied
+            if blockers & own and not (blockers & (blockers - 1)):
+                blocking |= blockers
+        return blocking
+
+    def get_discoverers(self, info, colour):
+        """colour's pieces standing alone between one of colour's sliders and
+        the enemy king, kept on the CheckInfo"""
+        if info.discoverers is None:
+            opp_king = self.black_king if colour == WHITE else self.white_king
+            own = self.white_pieces if colour == WHITE else self.black_pieces
+            bitboards = self.bitboards
+            diagonal = bitboards[PIECE_INDEX[colour | BISHOP]] | bitboards[PIECE_INDEX[colour | QUEEN]]
+            straight = bitboards[PIECE_INDEX[colour | ROOK]] | bitboards[PIECE_INDEX[colour | QUEEN]]
+            info.discoverers = self.get_blockers(opp_king, diagonal, straight, own)
+        return info.discoverers
 
     def is_capture(self, move):
-        start, end, _ = move
-        return self.board[end] != EMPTY
+        return bool(move & CAPTURE_FLAG)
 
     def op_turn(self):
         return WHITE if self.turn == BLACK else BLACK
 
     def is_checking_move(self, move):
-        start, end, promotion = move
-        moving_piece = self.board[start]
-        moving_piece_type = strip_piece(moving_piece)
-        colour = get_colour(moving_piece)
-        opp_king = self.white_king if colour == BLACK else self.black_king
-
-        if moving_piece_type == KING:
-            return False
-        if moving_piece_type == BISHOP:
-            my_bb = self.white_pieces if colour == WHITE else self.black_pieces
-            moves = self.generate_sliding_moves(end, self.bishop_rays, my_bb)
-        elif moving_piece_type == ROOK:
-            my_bb = self.white_pieces if colour == WHITE else self.black_pieces
-            moves = self.generate_sliding_moves(end, self.rook_rays, my_bb)
-        elif moving_piece_type == QUEEN:
-            my_bb = self.white_pieces if colour == WHITE else self.black_pieces
-            moves = self.generate_sliding_moves(end, self.bishop_rays, my_bb)
-            moves.extend(self.generate_sliding_moves(end, self.rook_rays, my_bb))
-        elif moving_piece_type == KNIGHT:
-            row, col = divmod(end, 8)
-            for drow, drcol in [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (2, -1), (2, 1), (1, -2), (1, 2)]:
-                r, c = row + drow, col + drcol
-                if 0 <= r < 8 and 0 <= c < 8:
-                    if opp_king == r*8 + c:
-                        return True
-            return False
-        elif moving_piece_type == PAWN:
-            if colour == WHITE:
-                return opp_king in self.bb_iterate(self.pawn_attacks_white[end])
+        """True if the piece moved by move (of the side to move) attacks the
+        enemy king from its new square"""
+        end = (move >> END_SHIFT) & MOVE_SQUARE
+        piece_type = (move >> PROMOTION_SHIFT) & MOVE_PROMOTION or self.board[move & MOVE_SQUARE]
+        check_squares = self.get_check_squares(self.get_check_info(), self.turn)
+        return bool(check_squares[strip_piece(piece_type)] & (1 << end))
+
+    def gives_check(self, move):
+        """True if move (of the side to move) checks the enemy king, directly
+        or by discovery. Worked out from the CheckInfo without making the
+        move, except for the rare en passant captures and castles"""
+        if move & (EP_FLAG | CASTLE_FLAG):
+            old_state = self.move_piece(move)
+            check = self.in_check(self.turn)
+            self.unmake_move(move, old_state)
+            return check
+
+        start = move & MOVE_SQUARE
+        end = (move >> END_SHIFT) & MOVE_SQUARE
+        colour = self.turn
+        info = self.get_check_info()
+        opp_king = self.black_king if colour == WHITE else self.white_king
+        promotion = (move >> PROMOTION_SHIFT) & MOVE_PROMOTION
+        if promotion:
+            # the pawn leaving its square can open a line for the new piece
+            piece_type = strip_piece(promotion)
+            occupied = ((self.white_pieces | self.black_pieces) ^ (1 << start)) | (1 << end)
+            if piece_type == KNIGHT:
+                attacks = self.knight_moves[end]
+            elif piece_type == BISHOP:
+                attacks = bishop_attacks(end, occupied)
+            elif piece_type == ROOK:
+                attacks = rook_attacks(end, occupied)
             else:
-                return opp_king in self.bb_iterate(self.pawn_attacks_black[end])
-
-        return opp_king in [new_pos for (pos, new_pos, prom) in moves]
-
-
-        return False
-
-    def make_move_adversary(self):
-        move, _ = find_best_move(self, 4)
+                attacks = queen_attacks(end, occupied)
+            if attacks & (1 << opp_king):
+                return True
+        elif self.get_check_squares(info, colour)[strip_piece(self.board[start])] & (1 << end):
+            return True
+        return bool(self.get_discoverers(info, colour) & (1 << start)
+                    and not (LINE[opp_king][start] & (1 << end)))
+
+    def make_move_adversary(self, time_limit=None):
+        """Search for at most time_limit seconds and play the best move found.
+        Returns the move played, or None if there is none because the game
+        is over (callers should check position_status first)"""
+        # lazy import, the search module is built on top of this one
+        from search import Searcher, DEFAULT_MOVE_TIME
+        if self.searcher is None:
+            self.searcher = Searcher()
+        if time_limit is None:
+            time_limit = DEFAULT_MOVE_TIME
+        move, _, _ = self.searcher.search(self, time_limit=time_limit)
+        if move is None:
+            return None
         self.move_piece(move)
+        return move
 
-def alphabeta(board, depth, alpha, beta, maximizing, tt):
+# keys of the perft cache are the zobrist key xored with one of these, so
+# the same position at different depths gets different entries
+PERFT_DEPTH_KEYS = [random.getrandbits(64) for _ in range(64)]
 
-    key = board.zobrist
-    entry = tt.lookup(key, depth)
-    if entry:
-        if entry[FLAG] == EXACT:
-            return entry[SCORE], entry[MOVE]
-        elif entry[FLAG] == LOWERBOUND:
-            alpha = max(alpha, entry[SCORE])
-        elif entry[FLAG] == UPPERBOUND:
-            beta = min(beta, entry[SCORE])
-        if alpha >= beta:
-            return entry[SCORE], entry[MOVE]
-    # Base case
-    if depth == 0:
-        return evaluate_board(board), None
-    if board.is_checkmate(board.turn):
-        if maximizing:
-            return -100000 - depth, None
-        else:
-            return 100000 + depth, None
-    if board.is_stalemate(board.turn):
-        return 0, None
-
-    best_move = None
-    legal_moves = board.generate_legal_moves(board.turn)
-
-    #do the captures first
-    legal_moves.sort(key=lambda m : board.is_capture(m) or board.is_checking_move(m), reverse=True)
-
-    if maximizing:
-        value = -float('inf')
-        for move in legal_moves:
-            old_state = board.move_piece(move)
-            score, _ = alphabeta(board, depth - 1, alpha, beta, False, tt)
-            board.unmake_move(move, old_state)
-
-            if score > value:
-                value = score
-                best_move = move
-
-            alpha = max(alpha, value)
-            if beta <= alpha:
-                break  # Beta cutoff
-        if value <= alpha:
-            flag = UPPERBOUND
-        elif value >= beta:
-            flag = LOWERBOUND
-        else:
-            flag = EXACT
-        tt.store(key, depth, value, flag, best_move)
-
-        return value, best_move
-
-    else:
-        value = float('inf')
-        for move in legal_moves:
-            old_state = board.move_piece(move)
-            score, _ = alphabeta(board, depth - 1, alpha, beta, True, tt)
-            board.unmake_move(move, old_state)
-
-            if score < value:
-                value = score
-                best_move = move
-
-            beta = min(beta, value)
-            if beta <= alpha:
-                break  # Alpha cutoff
-
-        if value <= alpha:
-            flag = UPPERBOUND
-        elif value >= beta:
-            flag = LOWERBOUND
-        else:
-            flag = EXACT
-        tt.store(key, depth, value, flag, best_move)
+class PerftCache(KeyedCache):
+    """
+    Fixed size cache of perft counts, indexed by zobrist key and depth.
+    """
 
-        return value, best_move
+    VALUE_TYPE = 'Q'
 
-def find_best_move(board, depth):
-    maximizing = (board.turn == WHITE)
-    tt = TranspositionTable()
-    score, best_move = alphabeta(board, depth, -float('inf'), float('inf'), maximizing, tt)
-    return best_move, score
+    def __init__(self, size_mb=16):
+        super().__init__(size_mb)
 
-def perft(board, depth, tt=None):
-    """Count leaf nodes at a given depth using make/unmake moves."""
+    def lookup(self, key, depth):
+        """Return the count stored for key at depth, or None"""
+        return self.probe(key ^ PERFT_DEPTH_KEYS[depth])
+
+    def store(self, key, depth, count):
+        super().store(key ^ PERFT_DEPTH_KEYS[depth], count)
+
+def perft(board, depth, tt=None, bulk=False):
+    """
+    Count leaf nodes at a given depth using make/unmake moves. tt is an
+    optional PerftCache for positions reached by more than one path. With
+    bulk, the last ply is counted from the length of the move list instead
+    of making every move.
+    """
     if depth == 0:
         return 1
+    if bulk and depth == 1:
+        return len(board.generate_legal_moves(board.turn))
     key = board.zobrist
     if tt:
         cached = tt.lookup(key, depth)
@@ -1293,32 +1317,145 @@ def perft(board, depth, tt=None):
     moves = board.generate_legal_moves(board.turn)
     for move in moves:
         old_state = board.move_piece(move)
-        total += perft(board, depth-1, tt)
+        total += perft(board, depth-1, tt, bulk)
         board.unmake_move(move, old_state)
     if tt:
         tt.store(key, depth, total)
 
-
     return total
 
-def show_split_perft(board, depth):
+def show_split_perft(board, depth, tt=None, bulk=False):
     legal_moves = board.generate_legal_moves(board.turn)
     total = 0
     for move in legal_moves:
         old_state = board.move_piece(move)
-        count = perft(board, depth-1)
-        print(f"{coordinate_to_square(move[0])}{coordinate_to_square(move[1])}: {count}")
+        count = perft(board, depth-1, tt, bulk)
+        print(f"{move_to_uci(move)}: {count}")
         total += count
         board.unmake_move(move, old_state)
         
     print(f"Total nodes: {total}")
     return total
 
+PERFT_STATS = ["nodes", "captures", "ep", "castles", "promotions",
+               "checks", "discovered_checks", "double_checks", "checkmates"]
+
+def perft_stats(board, depth):
+    """
+    Perft that also breaks the moves at each ply down by kind, to compare
+    the move generator against published perft tables. Returns a dict of
+    counts for each depth from 1 to depth. This is kept apart from perft, so
+    plain node counting doesn't pay for it.
+    """
+    stats = [dict.fromkeys(PERFT_STATS, 0) for _ in range(depth)]
+    if depth > 0:
+        _perft_stats(board, depth, stats[-depth:])
+    return stats
+
+def _perft_stats(board, depth, stats):
+    counts = stats[0]
+    for move in board.generate_legal_moves(board.turn):
+        end = (move >> END_SHIFT) & MOVE_SQUARE
+        old_state = board.move_piece(move)
+        counts["nodes"] += 1
+        if move & CAPTURE_FLAG:
+            counts["captures"] += 1
+        if move & EP_FLAG:
+            counts["ep"] += 1
+        if move & CASTLE_FLAG:
+            counts["castles"] += 1
+            # the rook is the piece that moved into a check
+            start = move & MOVE_SQUARE
+            end = start + 1 if end > start else start - 1
+        if move & (MOVE_PROMOTION << PROMOTION_SHIFT):
+            counts["promotions"] += 1
+
+        king = board.white_king if board.turn == WHITE else board.black_king
+        checkers = board.attackers_to(king, board.get_inverse_turn())
+        if checkers:
+            counts["checks"] += 1
+            # as in the published tables, a double check is not also
+            # counted as a discovered check
+            if checkers & (checkers - 1):
+                counts["double_checks"] += 1
+            elif checkers & ~(1 << end):
+                counts["discovered_checks"] += 1
+            if not board.generate_legal_moves(board.turn):
+                counts["checkmates"] += 1
+
+        if depth > 1:
+            _perft_stats(board, depth - 1, stats[1:])
+        board.unmake_move(move, old_state)
+
+def _perft_fen(fen, depth, cache_mb, bulk):
+    # lazy import, the parser is built on top of this module
+    from parser import parse_FEN
+    return perft(parse_FEN(fen), depth, PerftCache(cache_mb) if cache_mb else None, bulk)
+
+def parallel_split_perft(board, depth, jobs, show=True, cache_mb=0, bulk=False):
+    """
+    Split perft across jobs processes. Each root move (or, when there are
+    too few of them to keep every process busy, each reply to a root move)
+    is counted by its own task. A root move's count is printed as soon as
+    all of its tasks are done. Each task gets its own PerftCache of cache_mb
+    megabytes, if cache_mb is given.
+    """
+    from parser import board_to_FEN
+    if depth == 0:
+        return perft(board, depth)
+
+    root_moves = board.generate_legal_moves(board.turn)
+    if depth == 1:
+        # nothing worth handing to another process
+        if show:
+            for move in root_moves:
+                print(f"{move_to_uci(move)}: 1")
+            print(f"Total nodes: {len(root_moves)}")
+        return len(root_moves)
+    split_deeper = depth > 2 and len(root_moves) < 2 * jobs
+    pending = {move: 0 for move in root_moves}
+    counts = {move: 0 for move in root_moves}
+    tasks = [] # (root move, fen, depth)
+    for move in root_moves:
+        old_state = board.move_piece(move)
+        if split_deeper:
+            replies = board.generate_legal_moves(board.turn)
+            for reply in replies:
+                reply_state = board.move_piece(reply)
+                tasks.append((move, board_to_FEN(board), depth - 2))
+                board.unmake_move(reply, reply_state)
+            pending[move] = len(replies)
+        else:
+            tasks.append((move, board_to_FEN(board), depth - 1))
+            pending[move] = 1
+        board.unmake_move(move, old_state)
+
+    total = 0
+    if show:
+        # mated or stalemated straight after the root move, nothing to count
+        for move in root_moves:
+            if pending[move] == 0:
+                print(f"{move_to_uci(move)}: 0")
+    with process_pool(jobs) as pool:
+        futures = {pool.submit(_perft_fen, fen, sub_depth, cache_mb, bulk): move
+                   for move, fen, sub_depth in tasks}
+        for future in as_completed(futures):
+            move = futures[future]
+            counts[move] += future.result()
+            pending[move] -= 1
+            if pending[move] == 0:
+                total += counts[move]
+                if show:
+                    print(f"{move_to_uci(move)}: {counts[move]}")
+
+    if show:
+        print(f"Total nodes: {total}")
+    return total
+
 if __name__ == "__main__":
     game = Game()
     print(get_piece_name(game.board[61]))
     print(get_piece_name(game.board[62]))
     moves = game.generate_legal_moves(game.turn)
     for move in moves:
-        start, end, _ = move
-        print(coordinate_to_square(start), coordinate_to_square(end))
+        print(move_to_uci(move))
@@ -1,4 +1,7 @@
-from util import PAWN, BISHOP, QUEEN, KING, ROOK, KNIGHT, get_colour, WHITE, BLACK, strip_piece, EMPTY
+import os
+from util import (PAWN, BISHOP, QUEEN, KING, ROOK, KNIGHT, get_colour, WHITE, BLACK, strip_piece, EMPTY, PIECE_INDEX, KeyedCache,
+                  WHITE_PAWNS, BLACK_PAWNS)
+from attacks import FULL_BITBOARD
 
 
 # The value of a given piece. bishops slightly better than knights, knights
@@ -12,6 +15,19 @@ PIECE_VALS = {
     KING: 20000, #placeholder
 }
 
+# How much each piece counts towards the game phase. With all of them on
+# the board the phase is MAX_PHASE and the position is scored with the
+# midgame tables. As pieces come off it falls towards 0, the endgame
+PIECE_PHASE = {
+    PAWN: 0,
+    KNIGHT: 1,
+    BISHOP: 1,
+    ROOK: 2,
+    QUEEN: 4,
+    KING: 0,
+}
+MAX_PHASE = 24
+
 MATE_VALUE = 100000
 STALEMATE_VALUE = 0
 
@@ -73,6 +89,65 @@ PST_QUEEN = [
 -20,-10,-10, -5, -5,-10,-10,-20
 ]
 
+# Endgame tables. With fewer pieces left pawns are worth more the closer
+# they are to promoting, and the other pieces want the centre, where they
+# reach both wings
+
+PST_PAWN_ENDGAME = [
+  0,  0,  0,  0,  0,  0,  0,  0,
+ 80, 80, 80, 80, 80, 80, 80, 80,
+ 50, 50, 50, 50, 50, 50, 50, 50,
+ 30, 30, 30, 30, 30, 30, 30, 30,
+ 15, 15, 15, 15, 15, 15, 15, 15,
+  5,  5,  5,  5,  5,  5,  5,  5,
+  0,  0,  0,  0,  0,  0,  0,  0,
+  0,  0,  0,  0,  0,  0,  0,  0
+]
+
+PST_KNIGHT_ENDGAME = [
+-40,-30,-20,-20,-20,-20,-30,-40,
+-30,-15, -5,  0,  0, -5,-15,-30,
+-20, -5, 10, 10, 10, 10, -5,-20,
+-20,  0, 10, 15, 15, 10,  0,-20,
+-20,  0, 10, 15, 15, 10,  0,-20,
+-20, -5, 10, 10, 10, 10, -5,-20,
+-30,-15, -5,  0,  0, -5,-15,-30,
+-40,-30,-20,-20,-20,-20,-30,-40,
+]
+
+PST_BISHOP_ENDGAME = [
+-15,-10,-10,-10,-10,-10,-10,-15,
+-10,  0,  0,  0,  0,  0,  0,-10,
+-10,  0,  5,  5,  5,  5,  0,-10,
+-10,  0,  5, 10, 10,  5,  0,-10,
+-10,  0,  5, 10, 10,  5,  0,-10,
+-10,  0,  5,  5,  5,  5,  0,-10,
+-10,  0,  0,  0,  0,  0,  0,-10,
+-15,-10,-10,-10,-10,-10,-10,-15,
+]
+
+PST_ROOK_ENDGAME = [
+  0,  0,  0,  0,  0,  0,  0,  0,
+ 10, 10, 10, 10, 10, 10, 10, 10,
+  0,  0,  0,  0,  0,  0,  0,  0,
+  0,  0,  0,  0,  0,  0,  0,  0,
+  0,  0,  0,  0,  0,  0,  0,  0,
+  0,  0,  0,  0,  0,  0,  0,  0,
+  0,  0,  0,  0,  0,  0,  0,  0,
+  0,  0,  0,  0,  0,  0,  0,  0
+]
+
+PST_QUEEN_ENDGAME = [
+-20,-10,-10, -5, -5,-10,-10,-20,
+-10,  0,  5,  5,  5,  5,  0,-10,
+-10,  5, 10, 10, 10, 10,  5,-10,
+ -5,  5, 10, 15, 15, 10,  5, -5,
+ -5,  5, 10, 15, 15, 10,  5, -5,
+-10,  5, 10, 10, 10, 10,  5,-10,
+-10,  0,  5,  5,  5,  5,  0,-10,
+-20,-10,-10, -5, -5,-10,-10,-20
+]
+
 
 PST_KING_OPENING = [
 -30,-40,-40,-50,-50,-40,-40,-30,
@@ -106,66 +181,197 @@ MATCH_PIECE = {
     KING : PST_KING_OPENING,
 }
 
+MATCH_PIECE_ENDGAME = {
+    PAWN : PST_PAWN_ENDGAME,
+    KNIGHT : PST_KNIGHT_ENDGAME,
+    BISHOP : PST_BISHOP_ENDGAME,
+    ROOK : PST_ROOK_ENDGAME,
+    QUEEN : PST_QUEEN_ENDGAME,
+    KING : PST_KING_ENDGAME,
+}
+
 
 def mirror(idx):
     return idx ^ 56
 
-def count_minor_pieces(board, colour):
-    count = 0
 
-    if colour == WHITE:
-        minors = board.white_bishops | board.white_knights | board.white_rooks
-    else:
-        minors = board.black_bishops | board.black_knights | board.black_rooks
-
-    for _ in board.bb_iterate(minors):
-        count += 1
-    return count
-
-def is_endgame(board):
-    """we are in the endgame if, for both sides, """
-    white = not board.white_queens or (board.white_queens and count_minor_pieces(board, WHITE) <= 1)
-    black = not board.black_queens or (board.black_queens and count_minor_pieces(board, BLACK) <= 1)
-    return black and white
-
-
-def evaluate_board(board, depth=None):
-    board_list = board.board
-    score = 0
-    if depth is not None:
-        if board.is_checkmate(BLACK if board.turn == WHITE else WHITE):
-            return MATE_VALUE - depth
-        if board.is_stalemate(BLACK if board.turn == WHITE else WHITE):
-            return STALEMATE_VALUE - depth
-
-    for i in range(64):
-        piece = board_list[i]
-        if piece == EMPTY:
-            continue
+def build_piece_square_tables():
+    """
+    For every piece (indexed by the piece itself) and square, its material,
+    its weight in the game phase and its midgame and endgame table bonus.
+    Material and bonuses are signed so that white's count up and black's
+    count down. Game adds and subtracts these as pieces are
+    set and removed, so it always knows the evaluation of its position.
+    """
+    material = [0] * 16
+    phase = [0] * 16
+    midgame = [[0] * 64 for _ in range(16)]
+    endgame = [[0] * 64 for _ in range(16)]
+    for piece in PIECE_INDEX:
         piece_type = strip_piece(piece)
-        colour = get_colour(piece)
-
-        if colour == BLACK:
-            i = mirror(i)
-            factor = -1
-        else:
-            factor = 1
-
-        #add the piece's base value
-        score += factor * (PIECE_VALS[piece_type])
-
-        # get the piece's bonus value
-        if piece_type == KING:
-            if is_endgame(board):
-                bonus =  PST_KING_ENDGAME[i]
-            else:
-                bonus =  PST_KING_OPENING[i]
-        else:
-            bonus = MATCH_PIECE[piece_type][i]
-
-        score += factor * (bonus)
-
-    return score
+        sign = 1 if get_colour(piece) == WHITE else -1
+        material[piece] = sign * PIECE_VALS[piece_type]
+        phase[piece] = PIECE_PHASE[piece_type]
+        mg_table = MATCH_PIECE[piece_type]
+        eg_table = MATCH_PIECE_ENDGAME[piece_type]
+        for square in range(64):
+            # tables are from white's point of view, so black's squares are mirrored
+            i = square if sign == 1 else mirror(square)
+            midgame[piece][square] = sign * mg_table[i]
+            endgame[piece][square] = sign * eg_table[i]
+    return material, phase, midgame, endgame
+
+
+PIECE_MATERIAL, PIECE_PHASES, PST_MIDGAME, PST_ENDGAME = build_piece_square_tables()
+
+# Pawn structure. Each term is a (midgame, endgame) pair, given per pawn.
+# Passed pawns are worth more the further up the board they are (indexed
+# by rank counted from the pawn's own side, 0 to 7)
+DOUBLED_PAWN = (-10, -20)
+ISOLATED_PAWN = (-10, -15)
+BACKWARD_PAWN = (-8, -10)
+PASSED_PAWN_MIDGAME = [0, 5, 10, 15, 25, 40, 60, 0]
+PASSED_PAWN_ENDGAME = [0, 10, 20, 35, 55, 80, 110, 0]
+
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+
+# sizes in MB of the caches a Searcher evaluates with
+EVAL_CACHE_SIZE = 4
+PAWN_TABLE_SIZE = 1
+
+# Set CHESS_DEBUG_EVAL to check the running evaluation against one worked
+# out from scratch at every call to evaluate_board. Slow, for debugging only
+DEBUG_EVAL = bool(os.environ.get("CHESS_DEBUG_EVAL"))
+
+def full_evaluation(board):
+    """Work out the (material, phase, midgame table, endgame table) sums
+    that Game keeps up to date, from scratch"""
+    material = phase = midgame = endgame = 0
+    for piece, index in PIECE_INDEX.items():
+        for square in board.bb_iterate(board.bitboards[index]):
+            material += PIECE_MATERIAL[piece]
+            phase += PIECE_PHASES[piece]
+            midgame += PST_MIDGAME[piece][square]
+            endgame += PST_ENDGAME[piece][square]
+    return material, phase, midgame, endgame
+
+
+# Square 0 is a8, so white pawns move towards lower squares ("north")
+
+def north_fill(bb):
+    """bb and every square north of its squares"""
+    bb |= bb >> 8
+    bb |= bb >> 16
+    return bb | (bb >> 32)
+
+
+def south_fill(bb):
+    bb |= bb << 8
+    bb |= bb << 16
+    return (bb | (bb << 32)) & FULL_BITBOARD
+
+
+def east(bb):
+    return (bb << 1) & ~FILE_A & FULL_BITBOARD
+
+
+def west(bb):
+    return (bb >> 1) & ~FILE_H
+
+
+def pawn_structure(white, black):
+    """The (midgame, endgame) score of the pawn structure, from white's
+    point of view, given the two sides' pawn bitboards"""
+    # squares each side's pawns have in front of them, and the files they are on
+    white_front = north_fill(white >> 8)
+    black_front = south_fill(black << 8)
+    white_files = north_fill(south_fill(white))
+    black_files = north_fill(south_fill(black))
+    white_attacks = east(white >> 8) | west(white >> 8)
+    black_attacks = east(black << 8) | west(black << 8)
+
+    white_doubled = white & south_fill(white << 8)
+    black_doubled = black & north_fill(black >> 8)
+    white_isolated = white & ~(east(white_files) | west(white_files))
+    black_isolated = black & ~(east(black_files) | west(black_files))
+    # no pawn on a neighbouring file level with or behind it can come up to
+    # defend it, and an enemy pawn guards the square in front of it
+    white_backward = (white & ~white_isolated & ~(east(north_fill(white)) | west(north_fill(white)))
+                      & (black_attacks << 8))
+    black_backward = (black & ~black_isolated & ~(east(south_fill(black)) | west(south_fill(black)))
+                      & (white_attacks >> 8))
+    white_passed = white & ~white_doubled & ~(black_front | east(black_front) | west(black_front))
+    black_passed = black & ~black_doubled & ~(white_front | east(white_front) | west(white_front))
+
+    doubled = white_doubled.bit_count() - black_doubled.bit_count()
+    isolated = white_isolated.bit_count() - black_isolated.bit_count()
+    backward = white_backward.bit_count() - black_backward.bit_count()
+    midgame = doubled * DOUBLED_PAWN[0] + isolated * ISOLATED_PAWN[0] + backward * BACKWARD_PAWN[0]
+    endgame = doubled * DOUBLED_PAWN[1] + isolated * ISOLATED_PAWN[1] + backward * BACKWARD_PAWN[1]
+    while white_passed:
+        rank = 7 - (((white_passed & -white_passed).bit_length() - 1) >> 3)
+        midgame += PASSED_PAWN_MIDGAME[rank]
+        endgame += PASSED_PAWN_ENDGAME[rank]
+        white_passed &= white_passed - 1
+    while black_passed:
+        rank = ((black_passed & -black_passed).bit_length() - 1) >> 3
+        midgame -= PASSED_PAWN_MIDGAME[rank]
+        endgame -= PASSED_PAWN_ENDGAME[rank]
+        black_passed &= black_passed - 1
+    return midgame, endgame
+
+
+class EvalCache(KeyedCache):
+    """
+    Fixed size cache of evaluate_board scores, indexed by zobrist key. The
+    same position is often reached by several paths in a search.
+    """
+
+    def __init__(self, size_mb=EVAL_CACHE_SIZE):
+        super().__init__(size_mb)
+
+
+class PawnTable(KeyedCache):
+    """
+    Fixed size cache of pawn_structure's (midgame, endgame) scores, indexed
+    by the zobrist key of the pawns alone (Game.pawn_key). Pawns move
+    rarely, so almost every probe hits.
+    """
+
+    VALUE_WORDS = 2
+
+    def __init__(self, size_mb=PAWN_TABLE_SIZE):
+        super().__init__(size_mb)
+
+
+def evaluate_board(board, depth=None, pawn_table=None):
+    if depth is not None:
+        status = board.position_status()
+        if status.is_checkmate:
+            # the side to move has been mated, quicker mates are worth more
+            return -(MATE_VALUE - depth) if board.turn == WHITE else MATE_VALUE - depth
+        if status.is_stalemate:
+            return STALEMATE_VALUE
+
+    white_pawns = board.bitboards[WHITE_PAWNS]
+    black_pawns = board.bitboards[BLACK_PAWNS]
+    pawns = None if pawn_table is None else pawn_table.probe(board.pawn_key)
+    if pawns is None:
+        pawns = pawn_structure(white_pawns, black_pawns)
+        if pawn_table is not None:
+            pawn_table.store(board.pawn_key, pawns)
+
+    if DEBUG_EVAL:
+        assert (board.material, board.phase, board.pst_midgame, board.pst_endgame) == full_evaluation(board)
+        assert pawns == pawn_structure(white_pawns, black_pawns)
+    # blend the midgame and endgame scores by how far into the endgame we
+    # are, so the score doesn't jump as pieces are traded off (promotions
+    # can push the phase past MAX_PHASE)
+    phase = min(board.phase, MAX_PHASE)
+    midgame = board.pst_midgame + pawns[0]
+    endgame = board.pst_endgame + pawns[1]
+    return board.material + (midgame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
 
 
 
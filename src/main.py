@@ -1,10 +1,13 @@
 from pygame.event import get
-from board import Game, perft, show_split_perft
-from parser import (parse_PGN, parse_move, parse_FEN)
+from board import Game, perft, show_split_perft, parallel_split_perft, perft_stats, PerftCache
+from search import bench, Searcher, LazySMP, DEFAULT_TT_SIZE, MOVES_TO_GO, BENCH_POSITIONS
+from parser import (parse_PGN, parse_move, parse_FEN, fen_bench)
 from util import WHITE, BISHOP, KNIGHT, QUEEN, ROOK, get_real_index, BLACK
 import pygame as pg
 from view import View
 import argparse
+import atexit
+import json
 import time
 import subprocess
 import threading
@@ -26,7 +29,7 @@ def game_loop(board, view, file=None):
                 move = input("Make a move: ")
             else:
                 if len(moves) == 0:
-                    if board.in_checkmate(board.turn):
+                    if board.position_status().is_checkmate:
                         board.change_turn()
                         print(f"CHECKMATE. {board.turn} wins")
                     else:
@@ -42,11 +45,12 @@ def game_loop(board, view, file=None):
                     board.move_piece(moveset)
                 print(board)
 
-                if board.is_checkmate(board.turn):
+                status = board.position_status()
+                if status.is_checkmate:
                     board.change_turn()
                     print(f"CHECKMATE. {board.turn} wins")
                     break
-                if board.is_stalemate(board.turn):
+                if status.is_stalemate:
                     print(f"STALEMATE, Its a draw!")
 
 class Main():
@@ -100,16 +104,17 @@ class Main():
 
     def game_over_screen(self, player=WHITE, lost_on_time=None):
         opponent = WHITE if player == BLACK else BLACK
+        status = self.board.position_status()
         if lost_on_time is not None:
             mode = "time"
             if lost_on_time == player:
                 winner = opponent
             else:
                 winner = player
-        elif self.board.is_stalemate(self.board.turn):
+        elif status.is_stalemate:
             winner = None
             mode = "stalemate"
-        elif self.board.is_checkmate(player):
+        elif status.is_checkmate and self.board.turn == player:
             winner = opponent
             mode = "checkmate"
         else:
@@ -205,7 +210,9 @@ class Main():
                 black_pieces = self.board.black_captured_list.copy()
                 start = time.time()
                 bot_thinking = True
-                bot_thread = threading.Thread(target=self.board.make_move_adversary)
+                # spend an even share of what is left on the clock
+                bot_thread = threading.Thread(target=self.board.make_move_adversary,
+                                              args=(computer_time / MOVES_TO_GO,))
                 bot_thread.start()
 
             if bot_thread is not None and not bot_thread.is_alive() and bot_thinking:
@@ -213,7 +220,7 @@ class Main():
                 computer_time -= time.time() - start
                 start = time.time() 
                 bot_thinking = False
-                if self.board.is_checkmate(self.board.turn) or self.board.is_stalemate(self.board.turn):
+                if self.board.position_status().is_game_over:
                     self.game_over = True
 
             if not bot_thinking:
@@ -290,11 +297,11 @@ class Main():
         self.piece_held = None
 
     def move_piece(self, target, promotion_piece):
-        moveset = (get_real_index(self.piece_selected), get_real_index(target), promotion_piece)
+        moveset = self.board.find_move(get_real_index(self.piece_selected), get_real_index(target), promotion_piece)
         self.board.move_piece(moveset)
         self.piece_selected = None
         self.piece_held = None
-        if self.board.is_checkmate(self.board.turn) or self.board.is_stalemate(self.board.turn):
+        if self.board.position_status().is_game_over:
             self.game_over = True
 
 
@@ -331,6 +338,8 @@ def main():
     cmd_parser.add_argument("--GUI", action="store_true", help="run GUI")
     cmd_parser.add_argument("--FEN", required=False, default="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", help="provide the FEN")
     cmd_parser.add_argument("--mp", action="store_true", help="play against a friend")
+    cmd_parser.add_argument("--hash", type=int, default=DEFAULT_TT_SIZE, help="size of the engine's transposition table in MB")
+    cmd_parser.add_argument("--workers", type=int, default=1, help="number of processes the engine searches with")
 
     subparsers = cmd_parser.add_subparsers(dest="command", required=False)
     
@@ -340,20 +349,52 @@ def main():
     perft_parse = subparsers.add_parser("perft")
     perft_parse.add_argument("--comp", action="store_true", help="run stockfish on same position and compare output")
     perft_parse.add_argument("--no_moves", action="store_true", help="hide number of moves in each submove")
+    perft_parse.add_argument("--jobs", type=int, default=1, help="number of processes to split the perft across")
+    perft_parse.add_argument("--cache", action="store_true", help="cache counts of positions reached more than once (uses --hash MB)")
+    perft_parse.add_argument("--bulk", action="store_true", help="count the last ply from the move list length")
+    perft_parse.add_argument("--stats", action="store_true", help="print captures, checks, mates etc. at each depth as JSON")
     perft_parse.add_argument("depth", type=int, default=5, help="specify depth of perft search")
 
+    bench_parse = subparsers.add_parser("bench")
+    bench_parse.add_argument("depth", type=int, default=3, nargs="?", help="specify depth of each search")
+    bench_parse.add_argument("--movetime", type=float, default=None, help="search each position for this many seconds instead")
+
+    fen_bench_parse = subparsers.add_parser("fenbench")
+    fen_bench_parse.add_argument("count", type=int, default=100000, nargs="?", help="number of FENs to parse")
+    fen_bench_parse.add_argument("--file", default=None, help="read the FENs from this file, one per line")
+
     args = cmd_parser.parse_args()
 
-    if args.command == "perft":
+    if args.command == "bench":
+        bench(args.depth, tt_size=args.hash, time_limit=args.movetime, workers=args.workers)
+    elif args.command == "fenbench":
+        if args.file is None:
+            fens = BENCH_POSITIONS
+        else:
+            with open(args.file) as f:
+                fens = [line.strip() for line in f if line.strip()]
+        fen_bench(fens, args.count)
+    elif args.command == "perft":
         game = parse_FEN(args.FEN)
-        if args.no_moves:
+        cache = PerftCache(args.hash) if args.cache else None
+        if args.stats:
+            stats = perft_stats(game, args.depth)
+            print(json.dumps([{"depth": depth, **counts} for depth, counts in enumerate(stats, 1)], indent=2))
+            return
+        if args.jobs > 1:
             start = time.time()
-            num = perft(game, args.depth)
+            num = parallel_split_perft(game, args.depth, args.jobs, show=not args.no_moves,
+                                       cache_mb=args.hash if args.cache else 0, bulk=args.bulk)
+            end = time.time()
+            secs = end - start
+        elif args.no_moves:
+            start = time.time()
+            num = perft(game, args.depth, cache, args.bulk)
             end = time.time()
             secs = end - start
         else:
             start = time.time()
-            num = show_split_perft(game, args.depth)
+            num = show_split_perft(game, args.depth, cache, args.bulk)
             end = time.time()
             secs = end - start
         print(f"perft1: number of moves at depth {args.depth} = {num} in {secs}s")
@@ -370,6 +411,11 @@ def main():
     else:
         view = View()
         board = parse_FEN(args.FEN)
+        if args.workers > 1:
+            board.searcher = LazySMP(args.workers, args.hash)
+            atexit.register(board.searcher.close)
+        else:
+            board.searcher = Searcher(args.hash)
         if args.GUI:
             if args.mp:
                 Main(board, view, multiplayer=True)
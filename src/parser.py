@@ -1,3 +1,5 @@
+import time
+from itertools import cycle, islice
 from board import Game
 from typing import List, Tuple
 from util import (INV_PIECES, WHITE, BLACK, PAWN, BISHOP, KNIGHT, ROOK, QUEEN, KING,
@@ -21,6 +23,17 @@ def parse_FEN(text: str):
     fulls = int(fulls)
     return Game(board, turn, castling, ep_target, halfs, fulls)
 
+def fen_bench(fens, count=100000):
+    """Parse count FENs (going round fens as many times as needed), printing
+    the time taken and FENs parsed per second"""
+    fens = list(islice(cycle(fens), count))
+    start = time.perf_counter()
+    for fen in fens:
+        parse_FEN(fen)
+    secs = time.perf_counter() - start
+    print(f"parsed {count} FENs in {secs:.2f}s ({count / secs:.0f} FENs/s)")
+    return secs
+
 def get_board(text: str):
     """Takes in the board segment of the FEN, and returns a ListBoard.
     Where 0 is an empty square"""
@@ -102,7 +115,7 @@ def get_castling_str(castle: int):
         mask = 1 << (3 - i)
         if castle & mask:
             ans += INV_CASTLES[mask]
-    return ans
+    return ans if ans else "-"
 
 
 def parse_PGN( pgn):
@@ -229,9 +242,9 @@ def parse_castle(move, board):
     """Return the castling moveset represented by move"""
     row = 7 if board.turn == WHITE else 0
     if move in ['0-0', 'O-O']: #short castle
-        return (row*8 + 4, row*8 + 6, None)
+        return board.find_move(row*8 + 4, row*8 + 6)
     elif move in ['0-0-0', 'O-O-O']: #long castle
-        return (row*8 + 4, row*8 + 2, None)
+        return board.find_move(row*8 + 4, row*8 + 2)
     else:
         print("invalid move: did you mean castle?")
         
@@ -259,7 +272,7 @@ def parse_pawn(move, board):
             print(f"no legal move {move}")
             return
         if len(move) == 4:
-            return (ans[0][1]*8 + ans[0][0], ans[1][1]*8 + ans[1][0], ans[2])
+            return board.find_move(ans[0][1]*8 + ans[0][0], ans[1][1]*8 + ans[1][0])
         prom_valid_length = 6
     else:
         ending_square = convert_coordinate(move[0:2])
@@ -277,7 +290,7 @@ def parse_pawn(move, board):
             print(f"no valid move {move}")
             return
         if len(move) == 2:
-            return (ans[0][1]*8 + ans[0][0], ans[1][1]*8 + ans[1][0], ans[2])
+            return board.find_move(ans[0][1]*8 + ans[0][0], ans[1][1]*8 + ans[1][0])
         prom_valid_length = 4
 
     if len(move) == prom_valid_length:
@@ -288,7 +301,8 @@ def parse_pawn(move, board):
         if ending_square[1] != 0 and ending_square[1] != 7:
             print(f"Invalid Promotion: {move}")
             return
-        return (ans[0][1]*8 + ans[0][0], ans[1][1]*8 + ans[1][0], piece)
+        return board.find_move(ans[0][1]*8 + ans[0][0], ans[1][1]*8 + ans[1][0],
+                               strip_piece(PIECES[piece]) | board.turn)
     else:
         print(f"Invalid Length: {move}")
         return
@@ -297,11 +311,7 @@ def parse_pawn(move, board):
 def get_moveset(piece_str, target_coords, board, start_coords=None):
     """return a moveset based on the arguments to the method
 
-    A moveset is a triple containing:
-        1. The coordinates of the piece to be moved
-        2. The target coordinates for the piece
-        3. Promotion indicator: the string representation of the piece to
-        promote to, or None if we are not promoting
+    A moveset is a legal move packed into an int (see util.encode_move)
 
     Parameters:
         piece_str: a string representation of a piece
@@ -329,7 +339,7 @@ def get_moveset(piece_str, target_coords, board, start_coords=None):
                 if moveset is not None:
                     print("Insufficient disambiguation")
                     return
-                moveset = (row*8 + col, target_row*8 + target_col, None)
+                moveset = board.find_move(row*8 + col, target_row*8 + target_col)
             if start_col is not None: #only check this collumn
                 break
         if start_row is not None: #only check this row
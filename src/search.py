@@ -0,0 +1,777 @@
+import math
+import time
+from array import array
+from multiprocessing import shared_memory
+from eval import evaluate_board, EvalCache, PawnTable, MATE_VALUE, PIECE_VALS
+from board import GEN_NOISY, GEN_QUIET
+from parser import parse_FEN, board_to_FEN
+from util import (WHITE, PAWN, KING, NULL_MOVE, CAPTURE_FLAG, EP_FLAG, MOVE_PROMOTION, PROMOTION_SHIFT,
+                  END_SHIFT, MOVE_SQUARE, strip_piece, FixedCache, process_pool)
+
+# flags
+EXACT = 0
+UPPERBOUND = 1
+LOWERBOUND = 2
+
+# transposition table entries
+DEPTH = 0
+SCORE = 1
+FLAG = 2
+MOVE = 3
+
+MAX_PLY = 64
+MAX_DEPTH = 32
+MAX_MOVES = 256
+
+# seconds to think when no budget is given, and how many more moves the
+# game clock is assumed to need when splitting it up
+DEFAULT_MOVE_TIME = 5.0
+MOVES_TO_GO = 30
+
+# how many nodes to search between looking at the clock
+CHECK_EVERY = 1024
+
+# Captures are ordered most valuable victim first, then least valuable
+# attacker first (MVV-LVA). Indexed by [victim type][attacker type]; the
+# piece type numbers already go up with value.
+MVV_LVA = [[victim * 8 - attacker for attacker in range(KING + 1)] for victim in range(KING + 1)]
+
+# Quiet moves are ordered by how often they have caused a cutoff before.
+# The history table is indexed by the side to move and the move's start and
+# end squares, which are the low 12 bits of a packed move.
+BUTTERFLY = (1 << 12) - 1
+HISTORY_MAX = 1 << 20
+
+# Scores are kept within +-INFINITY. A mate found ply half moves from the
+# root scores MATE_VALUE - ply, so anything past MATE_BOUND is a mate.
+INFINITY = MATE_VALUE + 1
+MATE_BOUND = MATE_VALUE - 1000
+
+# half width of the first aspiration window, in centipawns
+ASPIRATION_WINDOW = 50
+
+# Null move pruning: if passing the turn still leaves us above beta after a
+# search reduced by NULL_REDUCTION (plus one more every NULL_DEPTH_STEP
+# plies), a real move will too. Only tried from NULL_MIN_DEPTH up.
+NULL_MIN_DEPTH = 3
+NULL_REDUCTION = 2
+NULL_DEPTH_STEP = 6
+
+# Late move reductions: quiet moves ordered after the first LMR_MIN_MOVES are
+# unlikely to be best, so search them less deep first, from LMR_MIN_DEPTH up.
+# The reduction grows with the depth and with how late the move comes.
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
+LMR_REDUCTIONS = [[0] + [int(0.75 + math.log(depth) * math.log(count) / 2.25) for count in range(1, 64)]
+                  for depth in range(1, MAX_DEPTH + 1)]
+
+# Pruning near the leaves, indexed by the remaining depth. At non-PV nodes
+# where the static evaluation is far below alpha:
+#   futility: quiet moves that can't make up FUTILITY_MARGINS are skipped
+#   razoring: the node drops straight into quiescence past RAZOR_MARGINS
+#   late move pruning: quiet moves after the first LMP_COUNTS are skipped
+FUTILITY_MARGINS = [0, 150, 300, 500]
+RAZOR_MARGINS = [0, 300, 500]
+LMP_COUNTS = [0, 6, 10, 16]
+
+# delta pruning: skip a capture in quiescence if winning the captured piece
+# plus this much still leaves us below alpha
+DELTA_MARGIN = 200
+
+DEFAULT_TT_SIZE = 16 # megabytes
+
+# A transposition table entry is packed into a 64-bit data word:
+#   bits 0-19:  best move
+#   bits 20-41: score (offset so it is never negative)
+#   bits 42-49: depth
+#   bits 50-51: flag
+#   bits 52-59: age of the search that stored it
+#   bit 60:     set for every stored entry, so an empty slot reads as 0
+TT_MOVE = (1 << 20) - 1
+TT_SCORE_SHIFT = 20
+TT_SCORE = (1 << 22) - 1
+TT_SCORE_OFFSET = 1 << 21
+TT_DEPTH_SHIFT = 42
+TT_DEPTH = 255
+TT_FLAG_SHIFT = 50
+TT_FLAG = 3
+TT_AGE_SHIFT = 52
+TT_AGE = 255
+TT_USED = 1 << 60
+
+# each bucket holds two slots of two words: the key xored with the data, and the data
+TT_BUCKET_WORDS = 4
+TT_BUCKET_BYTES = 8 * TT_BUCKET_WORDS
+
+NOISY = CAPTURE_FLAG | (MOVE_PROMOTION << PROMOTION_SHIFT)
+
+
+class TranspositionTable(FixedCache):
+    """
+    Fixed size table of search results, indexed by zobrist key.
+
+    The table is a flat array of 64-bit words split into buckets of two slots.
+    The first slot keeps the deepest result of the current search, the second
+    always takes the newest. A slot stores the key xored with its data word, so
+    a probe only matches when xoring the two words gives back the full key.
+    This catches two positions sharing a bucket, and a slot that is only half
+    written.
+    """
+
+    def __init__(self, size_mb=DEFAULT_TT_SIZE):
+        super().__init__(size_mb, TT_BUCKET_BYTES)
+        self.age = 0
+
+    def allocate(self, buckets):
+        self.table = array('Q', bytes(TT_BUCKET_BYTES * buckets))
+
+    def new_search(self):
+        """Age the table, entries from older searches get replaced first"""
+        super().new_search()
+        self.age = (self.age + 1) & TT_AGE
+
+    def clear(self):
+        self.table = array('Q', bytes(len(self.table) * 8))
+        self.age = 0
+
+    def probe(self, key):
+        """Return the (depth, score, flag, move) stored for key, or None"""
+        self.probes += 1
+        table = self.table
+        index = (key & self.mask) * TT_BUCKET_WORDS
+        for slot in (index, index + 2):
+            data = table[slot + 1]
+            if data and table[slot] ^ data == key:
+                self.hits += 1
+                return ((data >> TT_DEPTH_SHIFT) & TT_DEPTH,
+                        ((data >> TT_SCORE_SHIFT) & TT_SCORE) - TT_SCORE_OFFSET,
+                        (data >> TT_FLAG_SHIFT) & TT_FLAG,
+                        data & TT_MOVE)
+        return None
+
+    def lookup(self, key, depth):
+        entry = self.probe(key)
+        if entry and entry[DEPTH] >= depth:
+            return entry
+        return
+
+    def get_move(self, key):
+        """Return the best move stored for the position, whatever its depth"""
+        entry = self.probe(key)
+        return entry[MOVE] if entry else None
+
+    def store(self, key, depth, score, flag, move):
+        table = self.table
+        index = (key & self.mask) * TT_BUCKET_WORDS
+        data = (TT_USED | (self.age << TT_AGE_SHIFT) | (flag << TT_FLAG_SHIFT)
+                | (depth << TT_DEPTH_SHIFT) | ((score + TT_SCORE_OFFSET) << TT_SCORE_SHIFT)
+                | (move or NULL_MOVE))
+        old = table[index + 1]
+        if (not old or table[index] ^ old == key
+                or (old >> TT_AGE_SHIFT) & TT_AGE != self.age
+                or (old >> TT_DEPTH_SHIFT) & TT_DEPTH <= depth):
+            table[index] = key ^ data
+            table[index + 1] = data
+        else:
+            table[index + 2] = key ^ data
+            table[index + 3] = data
+
+    def stopped(self):
+        """True if another process has asked the search to stop"""
+        return False
+
+    def fill(self, sample=1000):
+        """Fraction of slots holding an entry from the current search,
+        estimated from the first sample buckets"""
+        table = self.table
+        buckets = min(sample, self.mask + 1)
+        used = 0
+        for slot in range(1, buckets * TT_BUCKET_WORDS, 2):
+            data = table[slot]
+            if data and (data >> TT_AGE_SHIFT) & TT_AGE == self.age:
+                used += 1
+        return used / (2 * buckets)
+
+
+def pick_moves(board, tt_move, killers, history=None):
+    """
+    Yield the legal moves of the side to move, best guesses first:
+    the transposition table move, then captures and promotions that don't
+    lose material by MVV-LVA, then the killer moves, then the captures that
+    do lose material, then the remaining quiet moves by their history score.
+    Each stage is only generated once the previous one has been searched, so a
+    cutoff on an early move saves generating the rest.
+    """
+    colour = board.turn
+
+    if tt_move and board.is_valid_move(tt_move):
+        yield tt_move
+    else:
+        tt_move = NULL_MOVE
+
+    noisy = board.generate_legal_moves(colour, GEN_NOISY)
+    noisy.sort(key=lambda move: order_score(board, move), reverse=True)
+    bad_captures = []
+    for move in noisy:
+        if move == tt_move:
+            continue
+        if not is_good_capture(board, move):
+            bad_captures.append(move)
+            continue
+        yield move
+
+    searched = [tt_move]
+    for killer in killers:
+        if killer and killer not in searched and not (killer & NOISY) and board.is_valid_move(killer):
+            searched.append(killer)
+            yield killer
+
+    yield from bad_captures
+
+    quiet = board.generate_legal_moves(colour, GEN_QUIET)
+    if history is not None:
+        offset = (colour >> 3) << 12
+        quiet.sort(key=lambda move: history[offset | (move & BUTTERFLY)], reverse=True)
+    for move in quiet:
+        if move not in searched:
+            yield move
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """
+    A transposition table in shared memory, so that several processes can
+    search with the same table. Slots are written without a lock: a slot
+    that two processes write at once fails the key check and reads as empty.
+    Two words after the table hold the age of the current search and a stop
+    flag, which the process that created the table sets for the others.
+    """
+
+    def __init__(self, size_mb=DEFAULT_TT_SIZE, name=None):
+        self.name = name
+        super().__init__(size_mb)
+        self.age = self.header[0]
+
+    def allocate(self, buckets):
+        """Create the shared memory, or attach to the table called self.name"""
+        size = self.size = TT_BUCKET_BYTES * buckets
+        self.owner = self.name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size + 16)
+            self.shm.buf[:size + 16] = bytes(size + 16)
+        else:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        self.name = self.shm.name
+        self.header = self.shm.buf[size:size + 16].cast('Q')
+        self.table = self.shm.buf[:size].cast('Q')
+
+    def advance(self):
+        """Start a new search for every process using the table"""
+        self.header[0] = (self.header[0] + 1) & TT_AGE
+        self.header[1] = 0
+
+    def stop(self):
+        self.header[1] = 1
+
+    def stopped(self):
+        return self.header[1] != 0
+
+    def new_search(self):
+        # the age is chosen by the owner in advance()
+        FixedCache.new_search(self)
+        self.age = self.header[0]
+
+    def clear(self):
+        self.shm.buf[:self.size] = bytes(self.size)
+
+    def close(self):
+        self.table.release()
+        self.header.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def evaluate(board, cache=None, pawn_table=None):
+    """The static evaluation from the side to move's point of view, looked up
+    in (and stored to) the EvalCache and PawnTable if given"""
+    score = None if cache is None else cache.probe(board.zobrist)
+    if score is None:
+        score = evaluate_board(board, pawn_table=pawn_table)
+        if cache is not None:
+            cache.store(board.zobrist, score)
+    return score if board.turn == WHITE else -score
+
+
+def score_to_tt(score, ply):
+    """Mate scores count plies from the root. The same position can be
+    reached at different plies, so store them counted from the position"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def order_score(board, move):
+    """MVV-LVA score of a capture or promotion, higher is searched first"""
+    board_list = board.board
+    score = 0
+    if move & EP_FLAG:
+        score = MVV_LVA[PAWN][PAWN]
+    elif move & CAPTURE_FLAG:
+        score = MVV_LVA[strip_piece(board_list[(move >> END_SHIFT) & MOVE_SQUARE])][strip_piece(board_list[move & MOVE_SQUARE])]
+    promotion = (move >> PROMOTION_SHIFT) & MOVE_PROMOTION
+    if promotion:
+        # as good as capturing the piece we promote to
+        score += MVV_LVA[strip_piece(promotion)][PAWN]
+    return score
+
+
+def capture_gain(board, move):
+    """The material won by a capture or promotion, if it is not recaptured"""
+    gain = 0
+    if move & EP_FLAG:
+        gain = PIECE_VALS[PAWN]
+    elif move & CAPTURE_FLAG:
+        gain = PIECE_VALS[strip_piece(board.board[(move >> END_SHIFT) & MOVE_SQUARE])]
+    promotion = (move >> PROMOTION_SHIFT) & MOVE_PROMOTION
+    if promotion:
+        gain += PIECE_VALS[strip_piece(promotion)] - PIECE_VALS[PAWN]
+    return gain
+
+
+def is_good_capture(board, move):
+    """False if the capture or promotion loses material to the replies on
+    its square (by SEE). Taking a piece worth at least the capturing one
+    can't, so those skip the exchange"""
+    if move & CAPTURE_FLAG and not move & (EP_FLAG | (MOVE_PROMOTION << PROMOTION_SHIFT)):
+        board_list = board.board
+        if (PIECE_VALS[strip_piece(board_list[(move >> END_SHIFT) & MOVE_SQUARE])]
+                >= PIECE_VALS[strip_piece(board_list[move & MOVE_SQUARE])]):
+            return True
+    return board.see(move) >= 0
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when it runs out of time or nodes"""
+
+
+class Searcher():
+    """The state shared by every node of a search"""
+
+    def __init__(self, tt_size=DEFAULT_TT_SIZE, null_move=True, lmr=True,
+                 futility=True, razoring=True, lmp=True):
+        self.tt = TranspositionTable(tt_size)
+        self.eval_cache = EvalCache()
+        self.pawn_table = PawnTable()
+        self.null_move = null_move
+        self.lmr = lmr
+        self.futility = futility
+        self.razoring = razoring
+        self.lmp = lmp
+        self.killers = [[NULL_MOVE, NULL_MOVE] for _ in range(MAX_PLY)]
+        self.history = [0] * (2 << 12)
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.pv_move = NULL_MOVE
+
+    def store_cutoff(self, board, move, ply, depth):
+        """Update the killers and history for a move that caused a cutoff"""
+        if move & NOISY:
+            return
+        self.store_killer(move, ply)
+        index = ((board.turn >> 3) << 12) | (move & BUTTERFLY)
+        # deep cutoffs are rarer and say more about the move
+        self.history[index] += depth * depth
+        if self.history[index] > HISTORY_MAX:
+            self.age_history()
+
+    def age_history(self):
+        """Halve the history scores, so newer cutoffs count for more"""
+        self.history = [score >> 1 for score in self.history]
+
+    def store_killer(self, move, ply):
+        """remember a quiet move that caused a cutoff, it will often cause one
+        in the sibling positions too"""
+        if ply >= MAX_PLY or move & NOISY:
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+
+    def check_limits(self):
+        """Stop the search if it has run out of time or nodes"""
+        if self.tt.stopped():
+            raise SearchTimeout()
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise SearchTimeout()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+
+    def quiesce(self, board, alpha, beta, ply):
+        """
+        Search only captures and promotions until the position is quiet, so
+        that the evaluation is never taken half way through an exchange. The
+        side to move can always stand pat on the static evaluation instead of
+        capturing. When in check every move is searched, since standing pat is
+        not an option there. Scored from the side to move's point of view.
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.check_limits()
+
+        in_check = board.in_check(board.turn)
+        if in_check and ply < MAX_PLY:
+            stand_pat = None
+            best_score = -INFINITY
+            moves = board.generate_legal_moves(board.turn)
+            if not moves:
+                return -MATE_VALUE + ply
+        else:
+            stand_pat = evaluate(board, self.eval_cache, self.pawn_table)
+            if ply >= MAX_PLY or stand_pat >= beta:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+            best_score = stand_pat
+            moves = board.generate_legal_moves(board.turn, GEN_NOISY)
+
+        moves.sort(key=lambda move: order_score(board, move), reverse=True)
+        for move in moves:
+            # delta pruning: even winning this piece for nothing can't get
+            # the score back up to alpha
+            if stand_pat is not None and stand_pat + capture_gain(board, move) + DELTA_MARGIN <= alpha:
+                continue
+            # nor can a capture that loses material once the exchange is over
+            if stand_pat is not None and not is_good_capture(board, move):
+                continue
+            old_state = board.move_piece(move)
+            try:
+                score = -self.quiesce(board, -beta, -alpha, ply + 1)
+            finally:
+                board.unmake_move(move, old_state)
+
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    def negamax(self, board, depth, alpha, beta, ply=0, allow_null=True):
+        """
+        Principal variation search, scored from the side to move's point of
+        view. The first move is searched with the full window. Every later
+        move is searched with a null window, which only proves the move is no
+        better than alpha. If that proof fails, the move is searched again
+        with the full window. Returns the score and the best move.
+        """
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.check_limits()
+        tt = self.tt
+        pv_node = beta - alpha > 1
+
+        key = board.zobrist
+        entry = tt.probe(key)
+        tt_move = entry[MOVE] if entry else NULL_MOVE
+        if ply == 0 and self.pv_move:
+            # the best move of the last iteration
+            tt_move = self.pv_move
+        # PV nodes are searched in full so the PV doesn't get cut short, and we
+        # never cut off at the root, we always want to come back with a move
+        if entry and entry[DEPTH] >= depth and not pv_node and ply > 0:
+            score = score_from_tt(entry[SCORE], ply)
+            flag = entry[FLAG]
+            if (flag == EXACT
+                    or (flag == LOWERBOUND and score >= beta)
+                    or (flag == UPPERBOUND and score <= alpha)):
+                return score, entry[MOVE]
+        # Base case
+        if depth <= 0:
+            return self.quiesce(board, alpha, beta, ply), None
+
+        turn = board.turn
+        # the move generation below needs the CheckInfo anyway
+        in_check = bool(board.get_check_info().checkers)
+        # only the non-PV nodes use the static evaluation
+        static_eval = None if pv_node or in_check else evaluate(board, self.eval_cache, self.pawn_table)
+
+        # razoring: hopelessly behind, see if any capture gets us back up
+        if (self.razoring and static_eval is not None and depth < len(RAZOR_MARGINS)
+                and static_eval + RAZOR_MARGINS[depth] <= alpha):
+            score = self.quiesce(board, alpha, alpha + 1, ply)
+            if depth == 1 or score <= alpha:
+                return score, None
+
+        # null move pruning. Not when in check, since passing would be illegal,
+        # and not without pieces, where zugzwang makes passing an advantage
+        if (self.null_move and allow_null and static_eval is not None
+                and depth >= NULL_MIN_DEPTH and board.has_non_pawn_material(turn)
+                and static_eval >= beta):
+            reduction = NULL_REDUCTION + depth // NULL_DEPTH_STEP
+            old_state = board.make_null_move()
+            try:
+                score = -self.negamax(board, depth - 1 - reduction, -beta, -beta + 1, ply + 1, False)[0]
+            finally:
+                board.unmake_null_move(old_state)
+            if score >= beta:
+                # a mate found after passing isn't a proven mate
+                return (beta if score >= MATE_BOUND else score), None
+
+        alpha_orig = alpha
+        best_score = -INFINITY
+        best_move = None
+        killers = self.killers[ply] if ply < MAX_PLY else ()
+        reduce = self.lmr and depth >= LMR_MIN_DEPTH and not in_check
+        # quiet moves may be pruned close to the leaves, unless we are looking for a mate
+        prune = static_eval is not None and depth < len(LMP_COUNTS) and abs(alpha) < MATE_BOUND
+        futile = prune and self.futility and static_eval + FUTILITY_MARGINS[depth] <= alpha
+        late = LMP_COUNTS[depth] if prune and self.lmp else MAX_MOVES
+        count = 0
+
+        for move in pick_moves(board, tt_move, killers, self.history):
+            count += 1
+            gives_check = board.gives_check(move)
+            if (prune and best_move is not None and not gives_check and not (move & NOISY)
+                    and (futile or count > late)):
+                continue
+            old_state = board.move_piece(move)
+            try:
+                if best_move is None:
+                    score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)[0]
+                else:
+                    reduction = 0
+                    if (reduce and count > LMR_MIN_MOVES and not (move & NOISY)
+                            and move not in killers and not gives_check):
+                        reduction = min(LMR_REDUCTIONS[depth - 1][min(count, 63)], depth - 2)
+                    score = -self.negamax(board, depth - 1 - reduction, -alpha - 1, -alpha, ply + 1)[0]
+                    if reduction and score > alpha:
+                        # it did better than expected, look at it properly
+                        score = -self.negamax(board, depth - 1, -alpha - 1, -alpha, ply + 1)[0]
+                    if alpha < score < beta:
+                        # it is better than the first move after all
+                        score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)[0]
+            finally:
+                # the board must be put back even if the search is stopped
+                board.unmake_move(move, old_state)
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self.store_cutoff(board, move, ply, depth)
+                        break
+
+        if best_move is None:
+            # the picker had no legal moves: checkmate or stalemate
+            if in_check:
+                return -MATE_VALUE + ply, None
+            return 0, None
+
+        if best_score <= alpha_orig:
+            flag = UPPERBOUND
+        elif best_score >= beta:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        tt.store(key, depth, score_to_tt(best_score, ply), flag, best_move)
+
+        return best_score, best_move
+
+    def search_root(self, board, depth, guess):
+        """
+        Search the root with an aspiration window around guess, the score of
+        the last iteration. A narrow window gives more cutoffs. If the score
+        falls outside it, widen that side and search again.
+        """
+        if depth == 1 or abs(guess) >= MATE_BOUND:
+            return self.negamax(board, depth, -INFINITY, INFINITY)
+        window = ASPIRATION_WINDOW
+        alpha, beta = guess - window, guess + window
+        while True:
+            score, move = self.negamax(board, depth, alpha, beta)
+            if score <= alpha:
+                alpha = max(score - window, -INFINITY)
+            elif score >= beta:
+                beta = min(score + window, INFINITY)
+            else:
+                return score, move
+            window *= 4
+
+    def fallback_move(self, board):
+        """A move to play when the search was stopped before finishing an
+        iteration: the transposition table's if it is legal, else the first
+        legal move (None if there are none)"""
+        moves = board.generate_legal_moves(board.turn)
+        entry = self.tt.probe(board.zobrist)
+        if entry and entry[MOVE] in moves:
+            return entry[MOVE]
+        return moves[0] if moves else None
+
+    def search(self, board, max_depth=MAX_DEPTH, time_limit=None, node_limit=None, start_depth=1):
+        """
+        Iterative deepening: search to depth 1, 2, 3... until max_depth, or
+        until time_limit seconds or node_limit nodes have been used. Each
+        iteration searches the previous one's best move first. Returns the
+        best move and score of the deepest completed iteration, and its depth.
+        If not even the first iteration completes, the move is the
+        transposition table's or else the first legal one, at depth 0. Like
+        evaluate_board, the score is positive when white is better.
+        """
+        self.tt.new_search()
+        self.eval_cache.new_search()
+        self.pawn_table.new_search()
+        self.killers = [[NULL_MOVE, NULL_MOVE] for _ in range(MAX_PLY)]
+        self.age_history()
+        self.nodes = 0
+        self.pv_move = NULL_MOVE
+        self.deadline = None if time_limit is None else time.time() + time_limit
+        self.node_limit = node_limit
+
+        best_move, best_score, completed = None, 0, 0
+        for depth in range(start_depth, max_depth + 1):
+            try:
+                score, move = self.search_root(board, depth, best_score)
+            except SearchTimeout:
+                if best_move is None:
+                    best_move = self.fallback_move(board)
+                break
+            if move is None:
+                break # no legal moves
+            best_move, best_score, completed = move, score, depth
+            self.pv_move = move
+            if abs(score) >= MATE_BOUND:
+                break # found a forced mate, searching deeper won't change it
+            if self.deadline is not None and time.time() >= self.deadline:
+                break
+        self.deadline = None
+        self.node_limit = None
+        if board.turn != WHITE:
+            best_score = -best_score
+        return best_move, best_score, completed
+
+    def find_best_move(self, board, depth):
+        move, score, _ = self.search(board, max_depth=depth)
+        return move, score
+
+
+def find_best_move(board, depth):
+    return Searcher().find_best_move(board, depth)
+
+
+# the helper searcher of each worker process
+_helper = None
+
+def _init_helper(tt_name, tt_size, options):
+    global _helper
+    _helper = Searcher(0, **options)
+    _helper.tt = SharedTranspositionTable(tt_size, tt_name)
+
+def _helper_search(fen, helper_id, max_depth, time_limit, node_limit):
+    board = parse_FEN(fen)
+    # half the helpers start a ply deeper, so that they are not all
+    # searching the same tree at the same time
+    start_depth = min(1 + helper_id % 2, max_depth)
+    move, score, depth = _helper.search(board, max_depth, time_limit, node_limit, start_depth)
+    return move, score, depth, _helper.nodes
+
+
+class LazySMP():
+    """
+    Search with several processes at once. Every process searches the same
+    root with its own Searcher, and they share what they find through one
+    transposition table, which lets each of them skip work another has done.
+    The main process searches too, and the result from the deepest completed
+    iteration is played. Has the same search() as Searcher, so it can be used
+    as a Game's searcher. workers counts the main process, so it must be
+    at least 2; with one, search with a Searcher instead.
+    """
+
+    def __init__(self, workers, tt_size=DEFAULT_TT_SIZE, **options):
+        if workers < 2:
+            raise ValueError(f"LazySMP needs at least 2 workers, got {workers}; use a Searcher for one")
+        self.workers = workers
+        self.tt = SharedTranspositionTable(tt_size)
+        self.searcher = Searcher(0, **options)
+        self.searcher.tt = self.tt
+        # the main process's own caches, for reporting
+        self.eval_cache = self.searcher.eval_cache
+        self.pawn_table = self.searcher.pawn_table
+        self.pool = process_pool(workers - 1, initializer=_init_helper, initargs=(self.tt.name, tt_size, options))
+        self.nodes = 0
+
+    def search(self, board, max_depth=MAX_DEPTH, time_limit=None, node_limit=None):
+        self.tt.advance()
+        fen = board_to_FEN(board)
+        helpers = [self.pool.submit(_helper_search, fen, helper_id, max_depth, time_limit, node_limit)
+                   for helper_id in range(1, self.workers)]
+        best = self.searcher.search(board, max_depth, time_limit, node_limit)
+        self.nodes = self.searcher.nodes
+        # the helpers may still be going if we finished early
+        self.tt.stop()
+        for helper in helpers:
+            move, score, depth, nodes = helper.result()
+            self.nodes += nodes
+            if move is not None and depth > best[2]:
+                best = (move, score, depth)
+        return best
+
+    def find_best_move(self, board, depth):
+        move, score, _ = self.search(board, max_depth=depth)
+        return move, score
+
+    def close(self):
+        self.pool.shutdown()
+        self.tt.close()
+
+
+# middlegame and tactical positions used to benchmark the search
+BENCH_POSITIONS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4",
+    "2kr3r/pp1q1ppp/2n1bn2/2bpp3/4P3/2PP1N2/PP1NBPPP/R1BQ1RK1 b - - 0 10",
+]
+
+
+def bench(depth, fens=BENCH_POSITIONS, tt_size=DEFAULT_TT_SIZE, time_limit=None, workers=1, **options):
+    """Search each position to depth (or for time_limit seconds), printing
+    nodes, time and nodes/sec. With more than one worker the search is Lazy
+    SMP. Any options are passed on to the Searcher"""
+    total_nodes = 0
+    total_time = 0
+    smp = LazySMP(workers, tt_size, **options) if workers > 1 else None
+    for fen in fens:
+        board = parse_FEN(fen)
+        if smp is None:
+            searcher = Searcher(tt_size, **options)
+        else:
+            searcher = smp
+            searcher.tt.clear()
+        start = time.time()
+        move, score, reached = searcher.search(board, depth if time_limit is None else MAX_DEPTH, time_limit)
+        secs = time.time() - start
+        total_nodes += searcher.nodes
+        total_time += secs
+        print(f"{fen}: depth {reached} nodes {searcher.nodes} time {secs:.2f}s nps {searcher.nodes / secs:.0f} "
+              f"tt hits {searcher.tt.hit_rate():.1%} fill {searcher.tt.fill():.1%} "
+              f"eval hits {searcher.eval_cache.hit_rate():.1%} pawn hits {searcher.pawn_table.hit_rate():.1%}")
+    print(f"Total: nodes {total_nodes} time {total_time:.2f}s nps {total_nodes / total_time:.0f}")
+    if smp is not None:
+        smp.close()
+    return total_nodes, total_time
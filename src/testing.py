@@ -1,8 +1,13 @@
 import enum
+import os
+import tempfile
 import unittest
 from parser import parse_FEN, board_to_FEN
-from board import Game, WHITE, BLACK, EMPTY, PAWN, KNIGHT, KING, QUEEN, perft
-from eval import evaluate_board
+from board import Game, WHITE, BLACK, EMPTY, PAWN, KNIGHT, KING, QUEEN, perft, perft_stats, parallel_split_perft, PerftCache
+from eval import evaluate_board, full_evaluation, pawn_structure, EvalCache, PawnTable, MATE_VALUE, MAX_PHASE, PST_ENDGAME
+from attacks import bishop_attacks, rook_attacks, queen_attacks, BETWEEN, LINE, KNIGHT_MOVES, build_tables, save_tables, load_tables
+from util import encode_move, decode_move, move_to_uci, WHITE_QUEEN, BISHOP, PIECE_INDEX, ZOBRIST_PIECE
+from search import evaluate, pick_moves, find_best_move, Searcher, LazySMP, TranspositionTable, SharedTranspositionTable, score_to_tt, score_from_tt, EXACT, LOWERBOUND, UPPERBOUND
 
 class BaseTest(unittest.TestCase):
 
@@ -24,6 +29,25 @@ class BaseTest(unittest.TestCase):
         # check eval is equal 
         self.assertTrue(evaluate_board(self.game) == 0)
 
+    def test_phase(self):
+        self.assertEqual(self.game.phase, MAX_PHASE)
+        # only kings and pawns left: all endgame, the king wants the centre
+        game = parse_FEN("8/4p3/8/8/3K4/8/4P3/k7 w - - 0 1")
+        self.assertEqual(game.phase, 0)
+        self.assertEqual(evaluate_board(game), game.material + game.pst_endgame)
+        self.assertGreater(evaluate_board(game), 0)
+        # a queen and rook each: 10/24 of the way from the endgame to the midgame
+        game = parse_FEN("1q2k3/8/8/8/8/8/8/1Q2K2R w - - 0 1")
+        self.assertEqual(game.phase, 10)
+        self.assertEqual(evaluate_board(game), game.material + (game.pst_midgame * 10 + game.pst_endgame * 14) // 24)
+        # in the endgame every pawn gains as it advances, for black too
+        for col in range(8):
+            white = [PST_ENDGAME[WHITE | PAWN][row*8 + col] for row in range(6, 0, -1)]
+            black = [-PST_ENDGAME[BLACK | PAWN][row*8 + col] for row in range(1, 7)]
+            self.assertEqual(white, sorted(set(white)))
+            self.assertEqual(black, white)
+        self.assertLess(PST_ENDGAME[WHITE | KNIGHT][56], PST_ENDGAME[WHITE | KNIGHT][27])
+
     def test_fen_roundtrip(self):
         # Convert back to FEN
         fen_back = board_to_FEN(self.game)
@@ -92,12 +116,37 @@ class KiwiPeteTest(unittest.TestCase):
         # Black pawns are in the right spot 
         self.assertEqual(self.game.black_pawns, make_bb(8, 10, 11, 13, 20, 22, 33, 47))
 
+    def test_piece_bitboards(self):
+        self.assertEqual(self.game.bitboards[PIECE_INDEX[WHITE | BISHOP]], self.game.white_bishops)
+        self.assertEqual(self.game.bitboards[PIECE_INDEX[BLACK | KING]], make_bb(4))
+        # every capture, castle and promotion puts back exactly what it moved
+        bitboards = list(self.game.bitboards)
+        for move in self.game.generate_legal_moves(self.game.turn):
+            old_state = self.game.move_piece(move)
+            self.assertEqual(sum(bb.bit_count() for bb in self.game.bitboards),
+                             (self.game.white_pieces | self.game.black_pieces).bit_count())
+            self.game.unmake_move(move, old_state)
+            self.assertEqual(self.game.bitboards, bitboards)
+
+    def test_incremental_eval(self):
+        # KiwiPete has castling and en passant, the other position promotions
+        for game in (self.game, parse_FEN("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1")):
+            scores = full_evaluation(game)
+            for move in game.generate_legal_moves(game.turn):
+                old_state = game.move_piece(move)
+                for reply in game.generate_legal_moves(game.turn):
+                    reply_state = game.move_piece(reply)
+                    self.assertEqual((game.material, game.phase, game.pst_midgame, game.pst_endgame), full_evaluation(game))
+                    game.unmake_move(reply, reply_state)
+                game.unmake_move(move, old_state)
+            self.assertEqual((game.material, game.phase, game.pst_midgame, game.pst_endgame), scores)
+
     def test_deltas(self):
         #white bishops
         self.assertTrue(self.game.turn == WHITE)
         self.assertEqual(len(self.game.generate_bishop_moves(self.game.turn)), 11)
         #move random pieces
-        self.game.move_piece((48, 40, None))
+        self.game.move_piece(self.game.find_move(48, 40))
         self.assertEqual(len(self.game.generate_bishop_moves(self.game.turn)), 8)
 
     def test_moves(self):
@@ -106,7 +155,7 @@ class KiwiPeteTest(unittest.TestCase):
 
     def test_zobrist(self):
         old = self.game.zobrist
-        move = (54, 38, None)
+        move = self.game.find_move(54, 38)
         stuff = self.game.move_piece(move)
         self.game.unmake_move(move, stuff)
         self.assertTrue(old == self.game.zobrist)
@@ -115,6 +164,37 @@ class KiwiPeteTest(unittest.TestCase):
         for i, count in enumerate([1, 48, 2039, 97862, 4085603]):
             self.assertEqual(perft(self.game, i), count)
 
+    def test_perft_stats(self):
+        stats = perft_stats(self.game, 3)
+        self.assertEqual([depth["nodes"] for depth in stats], [48, 2039, 97862])
+        self.assertEqual(stats[2], {"nodes": 97862, "captures": 17102, "ep": 45, "castles": 3162,
+                                    "promotions": 0, "checks": 993, "discovered_checks": 0,
+                                    "double_checks": 0, "checkmates": 1})
+        self.assertEqual(board_to_FEN(self.game), self.start_fen)
+
+    def test_hashed_perft(self):
+        cache = PerftCache(1)
+        self.assertEqual(perft(self.game, 3, cache, bulk=True), 97862)
+        # a second run is answered from the cache
+        self.assertEqual(perft(self.game, 3, cache), 97862)
+        self.assertGreater(cache.hits, 0)
+
+    def test_parallel_perft(self):
+        self.assertEqual(parallel_split_perft(self.game, 3, 2, show=False), 97862)
+        # few root moves for the jobs, so the split is one ply deeper
+        self.assertEqual(parallel_split_perft(self.game, 3, 32, show=False), 97862)
+        self.assertEqual(parallel_split_perft(self.game, 0, 2, show=False), 1)
+        self.assertEqual(parallel_split_perft(self.game, 1, 2, show=False), 48)
+        self.assertEqual(board_to_FEN(self.game), self.start_fen)
+
+class Position3Test(unittest.TestCase):
+    def setUp(self):
+        self.game = parse_FEN("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1")
+
+    def test_perft(self):
+        for i, count in enumerate([1, 14, 191, 2812, 43238]):
+            self.assertEqual(perft(self.game, i), count)
+
 class CheckTest(unittest.TestCase):
 
     def setUp(self):
@@ -123,13 +203,75 @@ class CheckTest(unittest.TestCase):
 
     def test_check(self):
         #Knight g4 to f6
-        self.assertTrue(self.game.is_checking_move((38, 21, None)))
+        self.assertTrue(self.game.is_checking_move(self.game.find_move(38, 21)))
         #Pawn gxf7
-        self.assertTrue(self.game.is_checking_move((22, 13, None)))
+        self.assertTrue(self.game.is_checking_move(self.game.find_move(22, 13)))
         # Rook e3
-        self.assertTrue(self.game.is_checking_move((45, 44, None)))
+        self.assertTrue(self.game.is_checking_move(self.game.find_move(45, 44)))
         # Queen e3
-        self.assertTrue(self.game.is_checking_move((51, 44, None)))
+        self.assertTrue(self.game.is_checking_move(self.game.find_move(51, 44)))
+        # Queen c3 does not
+        self.assertFalse(self.game.is_checking_move(self.game.find_move(51, 42)))
+
+    def test_check_info(self):
+        # black is in check from the bishop on b5
+        game = parse_FEN("4k3/8/8/1B6/8/8/8/4K2R b - - 0 1")
+        info = game.get_check_info()
+        self.assertIs(game.get_check_info(), info)
+        self.assertEqual(info.checkers, make_bb(25))
+        # take the bishop, or block on c6 or d7
+        self.assertEqual(info.block_mask, make_bb(25, 18, 11))
+        self.assertTrue(game.in_check(BLACK))
+        move = game.find_move(4, 5)
+        old_state = game.move_piece(move)
+        self.assertIsNone(game.check_info)
+        self.assertEqual(game.get_check_info().checkers, 0)
+        game.unmake_move(move, old_state)
+        # put back without working it out again
+        self.assertIs(game.check_info, info)
+
+    def test_pins(self):
+        game = parse_FEN("4k3/4r3/8/8/8/8/4N3/4K3 w - - 0 1")
+        info = game.get_check_info()
+        self.assertEqual(info.pinned, make_bb(52))
+        # the pinned knight can't move at all
+        self.assertEqual([move for move in game.generate_legal_moves(WHITE) if move & 63 == 52], [])
+
+    def test_evasions(self):
+        # double check from the rook and knight, so the bishop can't take
+        game = parse_FEN("4k3/4r3/8/8/8/5n2/6B1/4K3 w - - 0 1")
+        moves = game.generate_legal_moves(WHITE)
+        self.assertTrue(moves)
+        self.assertTrue(all(move & 63 == 60 for move in moves))
+        # the checking pawn can be taken en passant
+        game = parse_FEN("8/8/8/2k5/3Pp3/8/8/4K3 b - d3 0 1")
+        self.assertIsNotNone(game.find_move(36, 43))
+        # but not when it leaves the king on an open rank
+        game = parse_FEN("8/8/8/8/k2Pp2Q/8/8/4K3 b - d3 0 1")
+        self.assertIsNone(game.find_move(36, 43))
+
+    def test_gives_check(self):
+        # the knight on e4 blocks the rook, so any knight move is a discovered check
+        game = parse_FEN("4k3/8/8/8/4N3/8/8/4RK2 w - - 0 1")
+        self.assertTrue(game.gives_check(game.find_move(36, 19)))
+        # the bishop on d3 shields the king from the queen on d1, a pawn promotes with check
+        game = parse_FEN("3k4/1P6/8/8/8/3B4/8/3QK3 w - - 0 1")
+        self.assertTrue(game.gives_check(game.find_move(43, 29)))
+        self.assertTrue(all(game.gives_check(move) for move in game.generate_legal_moves(WHITE)
+                            if move & 63 == 43))
+        # every legal move two plies into some busy positions agrees with making it
+        for fen in ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1"]:
+            game = parse_FEN(fen)
+            for first in game.generate_legal_moves(game.turn):
+                state = game.move_piece(first)
+                for move in game.generate_legal_moves(game.turn):
+                    expected = game.gives_check(move)
+                    old_state = game.move_piece(move)
+                    self.assertEqual(expected, game.in_check(game.turn), move_to_uci(move))
+                    game.unmake_move(move, old_state)
+                game.unmake_move(first, state)
 
 class StalemateTest(unittest.TestCase):
 
@@ -138,8 +280,299 @@ class StalemateTest(unittest.TestCase):
         self.game = parse_FEN(self.start_fen)
 
     def test_stale(self):
-        self.game.move_piece((30, 22, None))
+        self.game.move_piece(self.game.find_move(30, 22))
         self.assertTrue(self.game.is_stalemate(self.game.turn))
+        status = self.game.position_status()
+        self.assertTrue(status.is_stalemate)
+        self.assertFalse(status.is_checkmate)
+        self.assertEqual(status.legal_moves, [])
+
+    def test_status(self):
+        # fool's mate
+        game = parse_FEN("rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3")
+        status = game.position_status()
+        self.assertTrue(status.in_check)
+        self.assertTrue(status.is_checkmate)
+        self.assertTrue(status.is_game_over)
+        self.assertEqual(evaluate_board(game, 0), -100000)
+        # nothing for the engine to play
+        fen = board_to_FEN(game)
+        self.assertIsNone(game.make_move_adversary(0.1))
+        self.assertEqual(board_to_FEN(game), fen)
+        status = self.game.position_status()
+        self.assertFalse(status.in_check or status.is_game_over)
+        self.assertEqual(status.legal_moves, self.game.generate_legal_moves(WHITE))
+
+class MoveEncodingTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        move = encode_move(12, 4, WHITE_QUEEN)
+        self.assertEqual(decode_move(move), (12, 4, WHITE_QUEEN))
+        self.assertEqual(move_to_uci(move), "e7e8q")
+        self.assertEqual(decode_move(encode_move(52, 36)), (52, 36, None))
+
+    def test_unmake_restores_state(self):
+        # covers castling, en passant and promotions (with and without captures)
+        for fen in ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+                    "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1"]:
+            game = parse_FEN(fen)
+            for move in game.generate_legal_moves(game.turn):
+                old_state = game.move_piece(move)
+                self.assertEqual(game.zobrist, game.compute_hash())
+                game.unmake_move(move, old_state)
+                self.assertEqual(board_to_FEN(game), fen)
+                self.assertEqual(game.zobrist, game.compute_hash())
+
+    def test_null_move(self):
+        fen = "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3"
+        game = parse_FEN(fen)
+        old_state = game.make_null_move()
+        self.assertEqual(game.turn, BLACK)
+        self.assertIsNone(game.ep_target)
+        self.assertEqual(game.zobrist, game.compute_hash())
+        game.unmake_null_move(old_state)
+        self.assertEqual(board_to_FEN(game), fen)
+        self.assertEqual(game.zobrist, game.compute_hash())
+
+    def test_non_pawn_material(self):
+        game = parse_FEN("4k3/pp6/8/8/8/8/6PP/4KN2 w - - 0 1")
+        self.assertTrue(game.has_non_pawn_material(WHITE))
+        self.assertFalse(game.has_non_pawn_material(BLACK))
+
+class SearchTest(unittest.TestCase):
+
+    def test_pick_moves(self):
+        game = parse_FEN("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        legal = game.generate_legal_moves(game.turn)
+        tt_move = game.find_move(60, 62) # castle
+        killer = game.find_move(48, 40)
+        picked = list(pick_moves(game, tt_move, [killer, encode_move(0, 1)]))
+        self.assertEqual(sorted(picked), sorted(legal))
+        self.assertEqual(picked[0], tt_move)
+        # all the captures come before the killer
+        self.assertTrue(all(game.is_capture(move) for move in picked[1:picked.index(killer)]))
+
+    def test_capture_order(self):
+        # pawn takes queen, then rook takes queen, then pawn takes pawn
+        game = parse_FEN("4k3/8/8/2q2p2/1P4P1/8/8/2R1K3 w - - 0 1")
+        picked = [move_to_uci(move) for move in pick_moves(game, 0, [])]
+        self.assertEqual(picked[:3], ["b4c5", "c1c5", "g4f5"])
+
+    def test_see(self):
+        # queen takes a pawn defended by a pawn
+        game = parse_FEN("4k3/8/3p4/4p3/3Q4/8/8/4K3 w - - 0 1")
+        self.assertEqual(game.see(game.find_move(35, 28)), 100 - 900)
+        # pawn takes a defended knight
+        game = parse_FEN("4k3/8/3p4/4n3/3P4/8/8/4K3 w - - 0 1")
+        self.assertEqual(game.see(game.find_move(35, 28)), 320 - 100)
+        # the rook behind the knight backs it up through the e-file
+        game = parse_FEN("4r1k1/8/8/4p3/8/5N2/8/4R1K1 w - - 0 1")
+        self.assertEqual(game.see(game.find_move(45, 28)), 100)
+        game = parse_FEN("4r1k1/8/8/4p3/8/5N2/8/6K1 w - - 0 1")
+        self.assertEqual(game.see(game.find_move(45, 28)), 100 - 320)
+
+    def test_bad_capture_order(self):
+        # Qxd6 wins a pawn, but Qxe5 loses the queen, so it goes after the killer
+        game = parse_FEN("4k3/8/3p4/4p3/3Q4/8/8/4K3 w - - 0 1")
+        killer = game.find_move(35, 27)
+        picked = [move_to_uci(move) for move in pick_moves(game, 0, [killer])]
+        self.assertEqual(picked[:3], ["d4d6", "d4d5", "d4e5"])
+
+    def test_history_order(self):
+        game = Game()
+        searcher = Searcher()
+        quiet = game.find_move(62, 45)
+        searcher.store_cutoff(game, quiet, 0, 3)
+        self.assertEqual(next(pick_moves(game, 0, [], searcher.history)), quiet)
+
+    def test_mate_in_one(self):
+        game = parse_FEN("r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4")
+        move, score = find_best_move(game, 2)
+        self.assertEqual(move_to_uci(move), "h5f7")
+
+    def test_quiescence(self):
+        # the d5 pawn is defended, so taking it loses the queen
+        game = parse_FEN("4k3/8/4p3/3p4/8/8/8/3QK3 w - - 0 1")
+        move, score = find_best_move(game, 1)
+        self.assertNotEqual(move_to_uci(move), "d1d5")
+        self.assertGreater(score, 500)
+
+    def test_mate_score_normalization(self):
+        # mated 5 plies from the root, stored at ply 3, found again at ply 1
+        stored = score_to_tt(-MATE_VALUE + 5, 3)
+        self.assertEqual(stored, -MATE_VALUE + 2)
+        self.assertEqual(score_from_tt(stored, 1), -MATE_VALUE + 3)
+        self.assertEqual(score_from_tt(score_to_tt(250, 3), 1), 250)
+
+    def test_mate_in_two(self):
+        game = parse_FEN("k7/8/2K5/8/8/8/8/7R w - - 0 1")
+        move, score, depth = Searcher().search(game, max_depth=5)
+        self.assertEqual(score, MATE_VALUE - 3)
+        # scores are from white's side, whoever is to move
+        game = parse_FEN("7r/8/8/8/8/2k5/8/K7 b - - 0 1")
+        move, score, depth = Searcher().search(game, max_depth=5)
+        self.assertEqual(score, -(MATE_VALUE - 3))
+
+    def test_pruning_options(self):
+        fen = "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10"
+        full = Searcher(null_move=False, lmr=False, futility=False, razoring=False, lmp=False)
+        reduced = Searcher(futility=False, razoring=False, lmp=False)
+        pruned = Searcher()
+        for searcher in (full, reduced, pruned):
+            searcher.search(parse_FEN(fen), max_depth=4)
+        self.assertLess(reduced.nodes, full.nodes)
+        self.assertLess(pruned.nodes, reduced.nodes)
+
+    def test_lazy_smp(self):
+        game = parse_FEN("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10")
+        smp = LazySMP(2, 1)
+        try:
+            move, score, depth = smp.search(game, max_depth=3)
+        finally:
+            smp.close()
+        self.assertIn(move, game.generate_legal_moves(game.turn))
+        self.assertEqual(depth, 3)
+        with self.assertRaises(ValueError):
+            LazySMP(1)
+
+    def test_iterative_deepening_budget(self):
+        game = parse_FEN("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        fen = board_to_FEN(game)
+        searcher = Searcher()
+        move, score, depth = searcher.search(game, node_limit=2000)
+        # stopped part way through an iteration, but still has a move from the last one
+        self.assertIn(move, game.generate_legal_moves(game.turn))
+        self.assertGreaterEqual(depth, 1)
+        self.assertLess(searcher.nodes, 2000 + 1024)
+        self.assertEqual(board_to_FEN(game), fen)
+        # with nothing searched, fall back on the table's move or the first legal one
+        searcher = Searcher()
+        moves = game.generate_legal_moves(game.turn)
+        self.assertEqual(searcher.fallback_move(game), moves[0])
+        searcher.tt.store(game.zobrist, 1, 0, EXACT, moves[5])
+        self.assertEqual(searcher.fallback_move(game), moves[5])
+
+class TranspositionTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tt = TranspositionTable(1)
+        self.buckets = self.tt.mask + 1
+
+    def test_store_probe(self):
+        move = encode_move(12, 4, WHITE_QUEEN)
+        self.tt.store(12345, 4, -350, LOWERBOUND, move)
+        self.assertEqual(self.tt.probe(12345), (4, -350, LOWERBOUND, move))
+        self.assertIsNone(self.tt.lookup(12345, 5))
+        # same bucket, different key
+        self.assertIsNone(self.tt.probe(12345 + self.buckets))
+        self.assertEqual(self.tt.hit_rate(), 2 / 3)
+
+    def test_shared_table(self):
+        owner = SharedTranspositionTable(1)
+        other = SharedTranspositionTable(1, owner.name)
+        try:
+            owner.advance()
+            other.new_search()
+            self.assertEqual(other.age, 1)
+            other.store(12345, 3, 40, EXACT, encode_move(52, 36))
+            self.assertEqual(owner.probe(12345), (3, 40, EXACT, encode_move(52, 36)))
+            owner.stop()
+            self.assertTrue(other.stopped())
+        finally:
+            other.close()
+            owner.close()
+
+    def test_replacement(self):
+        key = 7
+        deep, shallow, newest = key, key + self.buckets, key + 2*self.buckets
+        self.tt.store(deep, 6, 1, EXACT, 0)
+        self.tt.store(shallow, 2, 2, EXACT, 0)
+        self.tt.store(newest, 1, 3, UPPERBOUND, 0)
+        # the deep entry is kept, the always replace slot has the newest
+        self.assertEqual(self.tt.probe(deep)[1], 1)
+        self.assertIsNone(self.tt.probe(shallow))
+        self.assertEqual(self.tt.probe(newest)[1], 3)
+        # entries from an old search are replaced first
+        self.tt.new_search()
+        self.tt.store(shallow, 2, 2, EXACT, 0)
+        self.assertIsNone(self.tt.probe(deep))
+        self.assertEqual(self.tt.probe(shallow)[1], 2)
+        self.assertGreater(self.tt.fill(), 0)
+
+class PawnStructureTest(unittest.TestCase):
+
+    def test_pawn_structure(self):
+        # a3 and a2 are doubled and isolated, a3 is passed on the third rank
+        game = parse_FEN("4k3/8/8/8/8/P7/P7/4K3 w - - 0 1")
+        self.assertEqual(pawn_structure(game.white_pawns, game.black_pawns), (-20, -30))
+        # e3 is backward, d4 passed and f5 isolated
+        game = parse_FEN("4k3/8/8/5p2/3P4/4P3/8/4K3 w - - 0 1")
+        self.assertEqual(pawn_structure(game.white_pawns, game.black_pawns), (-8 + 15 + 10, -10 + 35 + 15))
+        # mirrored for black
+        game = parse_FEN("4k3/8/4p3/3p4/5P2/8/8/4K3 w - - 0 1")
+        self.assertEqual(pawn_structure(game.white_pawns, game.black_pawns), (8 - 15 - 10, 10 - 35 - 15))
+
+    def test_caches(self):
+        game = parse_FEN("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        pawn_key = game.pawn_key
+        # a knight move leaves the pawns alone, a capture of a pawn doesn't
+        move = game.find_move(28, 11)
+        old_state = game.move_piece(move)
+        self.assertEqual(game.pawn_key, pawn_key ^ ZOBRIST_PIECE[PIECE_INDEX[BLACK | PAWN]][11])
+        game.unmake_move(move, old_state)
+        self.assertEqual(game.pawn_key, pawn_key)
+
+        cache, pawn_table = EvalCache(1), PawnTable(1)
+        score = evaluate_board(game)
+        self.assertEqual(evaluate(game, cache, pawn_table), score)
+        self.assertEqual(evaluate(game, cache, pawn_table), score)
+        self.assertEqual((cache.hits, pawn_table.hits), (1, 0))
+        self.assertEqual(pawn_table.probe(game.pawn_key), pawn_structure(game.white_pawns, game.black_pawns))
+
+class SlidingAttackTest(unittest.TestCase):
+
+    def test_empty_board(self):
+        # a rook sees 14 squares and a bishop in the corner sees 7
+        self.assertEqual(bin(rook_attacks(36, 0)).count("1"), 14)
+        self.assertEqual(bishop_attacks(63, 0), make_bb(54, 45, 36, 27, 18, 9, 0))
+        self.assertEqual(queen_attacks(36, 0), rook_attacks(36, 0) | bishop_attacks(36, 0))
+
+    def test_blockers(self):
+        # rook on a1 blocked on a4 and d1, pieces behind the blockers are ignored
+        occupied = make_bb(32, 59, 24, 60)
+        self.assertEqual(rook_attacks(56, occupied), make_bb(48, 40, 32, 57, 58, 59))
+        # bishop on e4 blocked on f5
+        self.assertEqual(bishop_attacks(36, make_bb(29, 22)) & make_bb(29, 22), make_bb(29))
+
+    def test_between_and_line(self):
+        # a1 to a4, and a1 to d4 along the diagonal
+        self.assertEqual(BETWEEN[56][32], make_bb(48, 40))
+        self.assertEqual(BETWEEN[56][35], make_bb(49, 42))
+        self.assertEqual(BETWEEN[56][49], 0)
+        # not on a line: a knight's jump away
+        self.assertEqual(BETWEEN[56][41], 0)
+        self.assertEqual(LINE[56][41], 0)
+        self.assertEqual(LINE[56][35], LINE[35][56])
+        self.assertEqual(LINE[56][35], make_bb(56, 49, 42, 35, 28, 21, 14, 7))
+
+    def test_table_cache(self):
+        # games share the module's tables rather than building their own
+        self.assertIs(parse_FEN("8/8/8/8/8/8/8/K6k w - - 0 1").knight_moves, KNIGHT_MOVES)
+        self.assertEqual(KNIGHT_MOVES[56], make_bb(41, 50))
+        tables = build_tables()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "tables")
+            self.assertIsNone(load_tables(path))
+            save_tables(path, tables)
+            self.assertEqual(load_tables(path), tables)
+            with open(path, "rb") as f:
+                data = f.read()
+            # cut short, with something extra on the end, or not a table cache at all
+            for bad in (data[:-8], data + bytes(8), b"not a table cache"):
+                with open(path, "wb") as f:
+                    f.write(bad)
+                self.assertIsNone(load_tables(path))
 
 def make_bb(*nums):
     bb = 0
@@ -1,4 +1,7 @@
 import math
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 from typing import List, Tuple
 import random
 EMPTY = 0
@@ -67,6 +70,14 @@ PIECE_INDEX = {
     BLACK_KING : 11,
 }
 
+# where each piece's bitboard is kept in Game.bitboards
+WHITE_PAWNS, BLACK_PAWNS = PIECE_INDEX[WHITE_PAWN], PIECE_INDEX[BLACK_PAWN]
+WHITE_KNIGHTS, BLACK_KNIGHTS = PIECE_INDEX[WHITE_KNIGHT], PIECE_INDEX[BLACK_KNIGHT]
+WHITE_BISHOPS, BLACK_BISHOPS = PIECE_INDEX[WHITE_BISHOP], PIECE_INDEX[BLACK_BISHOP]
+WHITE_ROOKS, BLACK_ROOKS = PIECE_INDEX[WHITE_ROOK], PIECE_INDEX[BLACK_ROOK]
+WHITE_QUEENS, BLACK_QUEENS = PIECE_INDEX[WHITE_QUEEN], PIECE_INDEX[BLACK_QUEEN]
+WHITE_KINGS, BLACK_KINGS = PIECE_INDEX[WHITE_KING], PIECE_INDEX[BLACK_KING]
+
 random.seed(2025)
 
 ZOBRIST_PIECE = [[random.getrandbits(64) for _ in range(64)] for _ in range(12)]
@@ -103,6 +114,48 @@ PIECE_FILENAMES = {
     WHITE_KING:"wk", BLACK_KING:"bk",
 }
 
+# Moves are packed into a single int:
+#   bits 0-5:   start square
+#   bits 6-11:  end square
+#   bits 12-15: promotion piece (EMPTY if not promoting)
+#   bits 16-19: flags describing the move
+MOVE_SQUARE = 63
+MOVE_PROMOTION = 15
+END_SHIFT = 6
+PROMOTION_SHIFT = 12
+
+CAPTURE_FLAG = 1 << 16
+EP_FLAG = 1 << 17
+CASTLE_FLAG = 1 << 18
+DOUBLE_PUSH_FLAG = 1 << 19
+
+NULL_MOVE = 0
+
+def encode_move(start: int, end: int, promotion: int | None=None, flags: int=0) -> int:
+    return start | (end << END_SHIFT) | ((promotion or EMPTY) << PROMOTION_SHIFT) | flags
+
+def move_start(move: int) -> int:
+    return move & MOVE_SQUARE
+
+def move_end(move: int) -> int:
+    return (move >> END_SHIFT) & MOVE_SQUARE
+
+def move_promotion(move: int) -> int | None:
+    """Return the piece promoted to, or None if move is not a promotion"""
+    return ((move >> PROMOTION_SHIFT) & MOVE_PROMOTION) or None
+
+def decode_move(move: int) -> Tuple[int, int, int | None]:
+    """Unpack a move into a (start, end, promotion) triple"""
+    return move_start(move), move_end(move), move_promotion(move)
+
+def move_to_uci(move: int) -> str:
+    """e.g. e7e8q"""
+    ans = coordinate_to_square(move_start(move)) + coordinate_to_square(move_end(move))
+    promotion = move_promotion(move)
+    if promotion is not None:
+        ans += INV_PIECES[promotion].lower()
+    return ans
+
 def assemble_start_board():
     return [BLACK_ROOK, BLACK_KNIGHT, BLACK_BISHOP, BLACK_QUEEN, BLACK_KING, BLACK_BISHOP, BLACK_KNIGHT, BLACK_ROOK] \
               + ([BLACK_PAWN] * 8) \
@@ -234,6 +287,82 @@ class ListBoard():
 
 
 
+def process_pool(workers: int, **options) -> ProcessPoolExecutor:
+    """A pool of workers processes, for parallel perft and search. They are
+    spawned rather than forked, since the GUI may have threads running (it
+    searches from one), and forking a threaded process can deadlock the
+    child. Any options are passed on to ProcessPoolExecutor"""
+    return ProcessPoolExecutor(workers, mp_context=get_context("spawn"), **options)
+
+
+class FixedCache():
+    """
+    Base of the fixed size tables indexed by zobrist key. They have a power
+    of two slots of slot_bytes each, as many as fit in size_mb megabytes, so
+    memory use never grows, and count their probes and hits. Subclasses
+    allocate the slots.
+    """
+
+    def __init__(self, size_mb: int, slot_bytes: int):
+        slots = max(1, (size_mb * 1024 * 1024) // slot_bytes)
+        slots = 1 << (slots.bit_length() - 1) # round down to a power of two
+        self.mask = slots - 1
+        self.allocate(slots)
+        self.probes = 0
+        self.hits = 0
+
+    def allocate(self, slots: int):
+        raise NotImplementedError
+
+    def new_search(self):
+        self.probes = 0
+        self.hits = 0
+
+    def hit_rate(self) -> float:
+        """Fraction of probes since the last new_search that found an entry"""
+        return self.hits / self.probes if self.probes else 0.0
+
+
+class KeyedCache(FixedCache):
+    """
+    A FixedCache whose slots hold the key they were stored for and a value
+    of VALUE_WORDS 64-bit words (of array type VALUE_TYPE). Each word has
+    its own array, indexed like the keys. A newer store always replaces the
+    old one. With more than one word, values are tuples.
+    """
+
+    VALUE_WORDS = 1
+    VALUE_TYPE = 'q'
+
+    def __init__(self, size_mb: int):
+        super().__init__(size_mb, 8 * (1 + self.VALUE_WORDS))
+
+    def allocate(self, slots: int):
+        self.keys = array('Q', bytes(8 * slots))
+        self.columns = [array(self.VALUE_TYPE, bytes(8 * slots)) for _ in range(self.VALUE_WORDS)]
+        self.values = self.columns[0]
+
+    def probe(self, key: int):
+        """Return the value stored for key, or None"""
+        self.probes += 1
+        index = key & self.mask
+        if self.keys[index] == key:
+            self.hits += 1
+            if self.VALUE_WORDS == 1:
+                return self.values[index]
+            return tuple([column[index] for column in self.columns])
+        return None
+
+    def store(self, key: int, value):
+        index = key & self.mask
+        self.keys[index] = key
+        if self.VALUE_WORDS == 1:
+            self.values[index] = value
+        else:
+            for column, word in zip(self.columns, value):
+                column[index] = word
+
+
 def make_bit_board(*squares) -> int:
     bb = 0
     for square in squares:
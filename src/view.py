@@ -3,7 +3,7 @@ import pygame as pg
 from board import Game
 import os
 import time
-from util import get_piece_name, get_colour, EMPTY, get_real_index, BLACK, WHITE, PIECE_FILENAMES, count_value
+from util import get_piece_name, get_colour, EMPTY, get_real_index, BLACK, WHITE, PIECE_FILENAMES, count_value, move_end
 
 pg.init()
 
@@ -112,7 +112,7 @@ class BoardView(pg.Surface):
         if self.selected is None or self.selected_possible_moves is None or board_obj.is_empty(get_real_index(self.selected)):
             return
         for moveset in self.selected_possible_moves:
-                _, coords, _ = moveset
+                coords = move_end(moveset)
                 coords = (coords % 8, coords // 8) #convert back
                 coords = ((coords[0]) * self.square_width + (self.square_width // 2),
                           (coords[1]) * self.square_width + (self.square_width // 2))